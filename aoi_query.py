@@ -0,0 +1,28 @@
+import argparse
+import json
+import socket
+
+# Client of the live AoI query endpoint of a WiFresh destination (--query_socket)
+def query(socket_paths):
+    reports = []
+    for socket_path in socket_paths:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+        sock.close()
+        reports.append(json.loads(b''.join(chunks)))
+    return reports
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the live per-stream AoI of running WiFresh destinations')
+    parser.add_argument('socket_paths', nargs='+', help='Query socket paths, one per destination or shard')
+    args = parser.parse_args()
+
+    print("stream, age_s, mean_aoi_s, peak_aoi_s, polls, delivery_ratio")
+    for report in query(args.socket_paths):
+        for stream_label, stream in report['streams'].items():
+            delivery_ratio = 'n/a' if stream['delivery_ratio'] is None else f"{stream['delivery_ratio']:.3f}"
+            print(f"{stream_label}, {stream['age']:.6f}, {stream['mean_aoi']:.6f}, {stream['peak_aoi']:.6f}, {stream['polls']}, {delivery_ratio}")
+        print(f"{report['policy']} destination up {report['uptime']:.1f} s, {report['polls_sent']} polls sent, {report['poll_timeouts']} timed out")
@@ -0,0 +1,86 @@
+import time
+from collections import deque
+
+class ClockSynchronizer:
+    # NTP-style offset/skew estimator fed by TIME_REQUEST/TIME_RESPONSE exchanges.
+    # Only the lowest-RTT samples are trusted: queueing delay makes the path asymmetric,
+    # so samples with inflated RTT carry a biased offset and are filtered out instead of averaged in.
+    # Times and offsets are integer nanoseconds of time.monotonic_ns(), the constructor takes seconds.
+    def __init__(
+        self,
+        min_sync_interval=1.0,
+        max_sync_interval=64.0,
+        filter_size=8,
+        history_size=16,
+        settle_threshold=5e-4
+    ):
+        self.min_sync_interval = int(min_sync_interval * 1e9)  # Sync interval while the estimate is settling (ns)
+        self.max_sync_interval = int(max_sync_interval * 1e9)  # Upper bound of the sync interval once settled (ns)
+        self.sync_interval = self.min_sync_interval  # Current sync interval, adapted after every filtered sample
+        self.settle_threshold = int(settle_threshold * 1e9)  # Prediction error below which the estimate is considered settled (ns)
+        self.raw_samples = deque(maxlen=filter_size)  # Clock filter: (local_time, offset, rtt) of the latest exchanges
+        self.history = deque(maxlen=history_size)  # Filtered (local_time, offset, rtt) points used for the skew fit
+        self.reference_time = None  # Local time the offset estimate refers to
+        self.base_offset = 0  # Offset at reference_time
+        self.skew = 0.0  # Offset drift in nanoseconds per nanosecond
+        self.last_sync_time = time.monotonic_ns() - self.sync_interval
+        self.requests_sent = 0
+        self.samples_received = 0
+
+    def due(self, now):
+        return now - self.last_sync_time >= self.sync_interval
+
+    def request_sent(self, now):
+        self.last_sync_time = now
+        self.requests_sent += 1
+
+    def offset(self, now):
+        if self.reference_time is None:
+            return self.base_offset
+        return self.base_offset + round(self.skew * (now - self.reference_time))
+
+    def add_sample(self, t1, dest_time, t2):
+        # t1: local send time, dest_time: destination clock on reply, t2: local receive time
+        rtt = t2 - t1
+        if rtt < 0:
+            return
+        self.samples_received += 1
+        local_time = (t1 + t2) // 2
+        self.raw_samples.append((local_time, dest_time - local_time, rtt))
+        best = min(self.raw_samples, key=lambda sample: sample[2])
+        if self.history and best[0] <= self.history[-1][0]:
+            # The minimum-RTT sample has already been used; nothing new to learn
+            self.adjust_interval(None)
+            return
+        predicted = self.offset(best[0])
+        had_estimate = self.reference_time is not None
+        self.history.append(best)
+        self.fit()
+        self.adjust_interval(abs(best[1] - predicted) if had_estimate else None)
+
+    def fit(self):
+        # Least-squares line through the filtered points whose RTT is close to the best seen,
+        # so that a temporarily congested path cannot drag the skew estimate
+        min_rtt = min(sample[2] for sample in self.history)
+        points = [sample for sample in self.history if sample[2] <= 2 * min_rtt + 100_000]
+        self.reference_time, reference_offset, _ = points[-1]
+        if len(points) < 2 or points[-1][0] - points[0][0] < self.min_sync_interval:
+            self.base_offset = reference_offset
+            return
+        # Fit relative to the reference point, so that the floats stay small and exact
+        times = [sample[0] - self.reference_time for sample in points]
+        offsets = [sample[1] - reference_offset for sample in points]
+        mean_t = sum(times) / len(points)
+        mean_o = sum(offsets) / len(points)
+        var_t = sum((t - mean_t) ** 2 for t in times)
+        cov = sum((t - mean_t) * (o - mean_o) for t, o in zip(times, offsets))
+        self.skew = cov / var_t if var_t > 0 else 0.0
+        self.base_offset = reference_offset + round(mean_o - self.skew * mean_t)
+
+    def adjust_interval(self, prediction_error):
+        if prediction_error is None:
+            return
+        if prediction_error < self.settle_threshold:
+            self.sync_interval = min(self.sync_interval * 2, self.max_sync_interval)
+        else:
+            self.sync_interval = max(self.sync_interval / 2, self.min_sync_interval)
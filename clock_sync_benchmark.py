@@ -0,0 +1,122 @@
+import argparse
+import random
+import select
+import socket
+import threading
+import time
+from sensor import SensorData, DataType
+from clock_sync import ClockSynchronizer
+
+# Loopback comparison of the legacy EMA clock offset estimator and the min-RTT filtered one.
+# A fake destination answers TIME_REQUESTs with a clock that has a known offset and skew,
+# and injects random queueing delay on both directions of the exchange. Clocks are time.monotonic_ns().
+
+class FakeDestination:
+    def __init__(self, true_offset, skew, mean_delay, listen_port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', listen_port))
+        self.address = self.sock.getsockname()
+        self.true_offset = int(true_offset * 1e9)  # ns
+        self.skew = skew
+        self.mean_delay = mean_delay  # Mean of the exponential queueing delay per direction (seconds)
+        self.start_time = time.monotonic_ns()
+        self.running = True
+
+    def clock(self, local_time):
+        return local_time + self.offset_at(local_time)
+
+    def offset_at(self, local_time):
+        return self.true_offset + round(self.skew * (local_time - self.start_time))
+
+    def serve(self):
+        while self.running:
+            readable, _, _ = select.select([self.sock], [], [], 0.1)
+            if not readable:
+                continue
+            data_bytes, addr = self.sock.recvfrom(1024)
+            request = SensorData.from_bytes(data_bytes)
+            forward_delay = random.expovariate(1.0 / self.mean_delay)
+            reverse_delay = random.expovariate(1.0 / self.mean_delay)
+            threading.Timer(forward_delay, self.respond, (request.timestamp, addr, reverse_delay)).start()
+
+    def respond(self, source_time, addr, reverse_delay):
+        dest_time = self.clock(time.monotonic_ns())
+        response = f"TIME_RESPONSE:{dest_time}:{source_time}"
+        threading.Timer(reverse_delay, self.sock.sendto, (response.encode(), addr)).start()
+
+class EMAEstimator:
+    # The estimator the sources used before: sync_rounds requests every sync_interval folded in with a fixed EMA
+    def __init__(self, sync_interval=5, sync_rounds=5, clock_offset_alpha=0.02):
+        self.sync_interval = int(sync_interval * 1e9)
+        self.sync_rounds = sync_rounds
+        self.clock_offset_alpha = clock_offset_alpha
+        self.clock_offset = 0.0
+        self.last_sync_time = time.monotonic_ns() - self.sync_interval
+        self.requests_sent = 0
+
+    def due(self, now):
+        return now - self.last_sync_time >= self.sync_interval
+
+    def request_sent(self, now):
+        self.last_sync_time = now
+        self.requests_sent += 1
+
+    def add_sample(self, t1, dest_time, t2):
+        offset = dest_time - ((t1 + t2) // 2)
+        self.clock_offset = self.clock_offset_alpha * offset + (1 - self.clock_offset_alpha) * self.clock_offset
+
+    def offset(self, now):
+        return self.clock_offset
+
+def run_benchmark(duration, true_offset, skew, mean_delay, sample_interval=50_000_000):
+    destination = FakeDestination(true_offset, skew, mean_delay)
+    server_thread = threading.Thread(target=destination.serve, daemon=True)
+    server_thread.start()
+    estimators = {'ema': EMAEstimator(), 'min_rtt': ClockSynchronizer()}
+    socks = {}
+    for name in estimators:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        socks[name] = sock
+    errors = {name: [] for name in estimators}
+    start_time = time.monotonic_ns()
+    last_sample_time = start_time
+    while time.monotonic_ns() - start_time < duration * 1e9:
+        for name, estimator in estimators.items():
+            sock = socks[name]
+            if estimator.due(time.monotonic_ns()):
+                rounds = estimator.sync_rounds if isinstance(estimator, EMAEstimator) else 1
+                for _ in range(rounds):
+                    current_time = time.monotonic_ns()
+                    request = SensorData(is_fragmented=0, data_type=DataType.TIME_REQUEST, timestamp=current_time, data=b'')
+                    sock.sendto(request.to_bytes(), destination.address)
+                    estimator.request_sent(current_time)
+            readable, _, _ = select.select([sock], [], [], 0)
+            if readable:
+                data, _ = sock.recvfrom(1024)
+                parts = data.decode().split(':')
+                estimator.add_sample(int(parts[2]), int(parts[1]), time.monotonic_ns())
+        now = time.monotonic_ns()
+        if now - last_sample_time >= sample_interval:
+            last_sample_time = now
+            for name, estimator in estimators.items():
+                errors[name].append(abs(estimator.offset(now) - destination.offset_at(now)))
+        time.sleep(0.001)
+    destination.running = False
+    server_thread.join()
+    for name, estimator in estimators.items():
+        # Ignore the first half of the run so that the comparison reflects steady-state accuracy
+        steady_errors = errors[name][len(errors[name]) // 2:]
+        mean_error = sum(steady_errors) / len(steady_errors)
+        print(f"{name}: requests sent {estimator.requests_sent}, "
+              f"steady-state mean |offset error| {mean_error / 1e6:.3f} ms, max {max(steady_errors) / 1e6:.3f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare clock offset estimators on loopback with injected delay')
+    parser.add_argument('--duration', type=float, default=60.0, help='Benchmark duration in seconds')
+    parser.add_argument('--offset', type=float, default=0.25, help='True clock offset of the fake destination in seconds')
+    parser.add_argument('--skew', type=float, default=50e-6, help='True clock skew of the fake destination in seconds per second')
+    parser.add_argument('--mean_delay', type=float, default=0.01, help='Mean injected queueing delay per direction in seconds')
+    args = parser.parse_args()
+    run_benchmark(args.duration, args.offset, args.skew, args.mean_delay)
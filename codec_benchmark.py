@@ -0,0 +1,94 @@
+import argparse
+import math
+import random
+import struct
+import time
+from sensor import SensorData, IP_UDP_HEADER_SIZE
+from payload_codec import make_codec, encode_payload, decode_payload
+
+# Compression CPU of each payload codec against the airtime and AoI it saves per update. No sockets: every update
+# costs one poll round per fragment, a fragment costs its bytes at the PHY rate plus a fixed per-frame overhead,
+# and the age at delivery shrinks by the poll rounds saved minus the encode and decode time.
+
+def image_payload(size, seed):
+    # Grayscale frame: smooth gradient, a few flat shapes and sensor noise of a couple of levels
+    rng = random.Random(seed)
+    width = 160
+    shapes = [(rng.randrange(width), rng.randrange(size // width), rng.randrange(8, 40), rng.randrange(256)) for _ in range(6)]
+    pixels = bytearray(size)
+    for idx in range(size):
+        x, y = idx % width, idx // width
+        value = (x + 2 * y + seed) // 2
+        for cx, cy, radius, level in shapes:
+            if (x - cx) ** 2 + (y - cy) ** 2 < radius * radius:
+                value = level
+        pixels[idx] = (value + rng.randrange(4)) & 0xff
+    return bytes(pixels)
+
+def sensor_payload(size, seed):
+    # Slowly varying float32 channels, like successive POSITION / INERTIAL_MEASUREMENT samples
+    values = [math.sin((seed + idx) / 50) * 10 + idx % 3 for idx in range(size // 4)]
+    return struct.pack(f'<{len(values)}f', *values).ljust(size, b'\0')
+
+def random_payload(size, seed):
+    # Incompressible bytes (Random.randbytes needs Python 3.9)
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+PAYLOADS = {
+    'image': image_payload,
+    'sensor': sensor_payload,
+    'random': random_payload,
+}
+
+def benchmark(codec_spec, payloads, mtu, phy_rate, frame_overhead, poll_round):
+    codec = make_codec(codec_spec)
+    max_payload = mtu - IP_UDP_HEADER_SIZE - SensorData.header_size
+    encode_time = decode_time = 0.0
+    raw_bytes = encoded_bytes = raw_fragments = encoded_fragments = 0
+    for data in payloads:
+        start = time.perf_counter()
+        codec_id, encoded = encode_payload(codec, data)
+        encode_time += time.perf_counter() - start
+        start = time.perf_counter()
+        if decode_payload(codec_id, encoded) != data:
+            raise ValueError(f"{codec_spec} does not round-trip")
+        decode_time += time.perf_counter() - start
+        raw_bytes += len(data)
+        encoded_bytes += len(encoded)
+        raw_fragments += max(1, math.ceil(len(data) / max_payload))
+        encoded_fragments += max(1, math.ceil(len(encoded) / max_payload))
+    count = len(payloads)
+    header_bytes = SensorData.header_size + IP_UDP_HEADER_SIZE
+    raw_airtime = ((raw_bytes + raw_fragments * header_bytes) * 8 / phy_rate + raw_fragments * frame_overhead) / count
+    encoded_airtime = ((encoded_bytes + encoded_fragments * header_bytes) * 8 / phy_rate + encoded_fragments * frame_overhead) / count
+    cpu = (encode_time + decode_time) / count
+    aoi_saved = (raw_fragments - encoded_fragments) / count * poll_round - cpu
+    return {
+        'ratio': encoded_bytes / raw_bytes,
+        'fragments': encoded_fragments / count,
+        'encode_us': encode_time / count * 1e6,
+        'decode_us': decode_time / count * 1e6,
+        'airtime_saved_us': (raw_airtime - encoded_airtime) * 1e6,
+        'aoi_saved_ms': aoi_saved * 1e3,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare payload codec CPU against the airtime and AoI saved per update')
+    parser.add_argument('--codecs', nargs='+', default=['none', 'zlib:1', 'zlib:6', 'zlib:9', 'lzma:0', 'lzma:6'], help='Codecs in the format codec[:level]')
+    parser.add_argument('--payloads', nargs='+', choices=sorted(PAYLOADS), default=['image', 'sensor', 'random'], help='Synthetic payload kinds')
+    parser.add_argument('--size', type=int, default=19456, help='Payload size in bytes, 19456 is the IMAGE size of multi_source_topo.py')
+    parser.add_argument('--updates', type=int, default=20, help='Updates per payload kind')
+    parser.add_argument('--mtu', type=int, default=1500, help='Link MTU used to size fragments')
+    parser.add_argument('--phy_rate', type=float, default=54e6, help='PHY rate in bit/s')
+    parser.add_argument('--frame_overhead', type=float, default=100e-6, help='Per-frame airtime overhead in seconds (preamble, DIFS, backoff, ACK)')
+    parser.add_argument('--poll_round', type=float, default=1e-3, help='Time of one poll round, i.e. one fragment delivered, in seconds')
+    args = parser.parse_args()
+
+    print("payload, codec, compression_ratio, fragments_per_update, encode_us, decode_us, airtime_saved_us, aoi_saved_ms")
+    for payload_kind in args.payloads:
+        payloads = [PAYLOADS[payload_kind](args.size, seed) for seed in range(args.updates)]
+        for codec_spec in args.codecs:
+            result = benchmark(codec_spec, payloads, args.mtu, args.phy_rate, args.frame_overhead, args.poll_round)
+            print(f"{payload_kind}, {codec_spec}, {result['ratio']:.3f}, {result['fragments']:.1f}, {result['encode_us']:.0f}, {result['decode_us']:.0f}, "
+                  f"{result['airtime_saved_us']:.0f}, {result['aoi_saved_ms']:.2f}")
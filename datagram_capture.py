@@ -0,0 +1,56 @@
+import json
+import socket
+import struct
+from sensor import DataType
+
+# Capture file of a destination run: magic, u32 length and JSON configuration of the destination, then one record
+# per datagram: direction u8, destination monotonic time i64 (ns) of the loop pass, peer port u16, peer IPv4 address,
+# receive delay u32 (ns the datagram waited since its kernel receive timestamp, 0 without kernel timestamps), length u32, bytes
+MAGIC = b'AOICAP1\n'
+CONFIG_LENGTH = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<BqH4sII')
+INBOUND = 0  # Datagram received by the destination
+OUTBOUND = 1  # POLL or BURST sent by the destination
+
+def encode_streams(streams):
+    return [[stream[0], stream[1], DataType(stream[2]).name, *stream[3:]] for stream in streams]
+
+def decode_streams(streams):
+    return [(stream[0], stream[1], DataType[stream[2]], *stream[3:]) for stream in streams]
+
+class DatagramRecorder:
+    # Appends through the file buffer, a record costs one header pack and two buffered writes
+    def __init__(self, capture_path, config):
+        self.file = open(capture_path, 'wb')
+        config_bytes = json.dumps(config).encode()
+        self.file.write(MAGIC + CONFIG_LENGTH.pack(len(config_bytes)) + config_bytes)
+        self.records = 0
+
+    def record(self, direction, now, addr, data, receive_delay=0):
+        self.file.write(RECORD_HEADER.pack(direction, now, addr[1], socket.inet_aton(addr[0]), min(receive_delay, 0xffffffff), len(data)))
+        self.file.write(data)
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+def read_capture(capture_path):
+    # Return (configuration, [(direction, time, (ip, port), data, receive delay)...]), parsed up front so a replay only measures the destination
+    with open(capture_path, 'rb') as capture_file:
+        capture = capture_file.read()
+    if not capture.startswith(MAGIC):
+        raise ValueError(f"{capture_path} is not a datagram capture")
+    offset = len(MAGIC)
+    config_length, = CONFIG_LENGTH.unpack_from(capture, offset)
+    offset += CONFIG_LENGTH.size
+    config = json.loads(capture[offset:offset + config_length])
+    offset += config_length
+    records = []
+    while offset + RECORD_HEADER.size <= len(capture):
+        direction, time_ns, port, ip, receive_delay, length = RECORD_HEADER.unpack_from(capture, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(capture):
+            break  # Truncated by a killed destination
+        records.append((direction, time_ns, (socket.inet_ntoa(ip), port), capture[offset:offset + length], receive_delay))
+        offset += length
+    return config, records
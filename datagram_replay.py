@@ -0,0 +1,101 @@
+import argparse
+import random
+import time
+from datagram_capture import read_capture, decode_streams, INBOUND, OUTBOUND
+from sensor import DataType
+from wifresh_destination import WiFreshDestination
+from wifi_udp_fcfs_destination import WiFiUDPFcfsDestination
+
+# Feed a capture of a destination run (--record_file) back into a fresh destination with the same configuration,
+# as fast as possible. Time is virtual: the clock jumps to the capture time of each record and the destination
+# runs one loop pass there, so the same capture and the same code always give the same polls and ages.
+# The recorded responses answered the recorded polls, the replayed polls are compared against them.
+
+class VirtualClock:
+    def __init__(self, now: int):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class ReplaySocket:
+    # Stands in for the UDP socket of the replayed destination, keeps what it sends
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((bytes(data), addr[:2]))
+        return len(data)
+
+    def setblocking(self, flag):
+        pass
+
+def make_destination(config, clock, sock, age_record_dir, **overrides):
+    sources_addresses = decode_streams(config['sources'])
+    kwargs = dict(config['kwargs'], **overrides)
+    if config['destination'] == 'udp_fcfs':
+        return WiFiUDPFcfsDestination(sources_addresses=sources_addresses, age_record_dir=age_record_dir, clock=clock, sock=sock, **kwargs)
+    # Arguments of the recorded policy do not carry over to another one
+    policy_kwargs = kwargs.pop('policy_kwargs', {})
+    if 'policy' in overrides:
+        policy_kwargs = {}
+    if 'weights' in policy_kwargs:
+        policy_kwargs['weights'] = {
+            DataType[key] if isinstance(key, str) else decode_streams([key])[0]: weight for key, weight in policy_kwargs['weights']
+        }
+    return WiFreshDestination(sources_addresses=sources_addresses, age_record_dir=age_record_dir, policy_kwargs=policy_kwargs, clock=clock, sock=sock, **kwargs)
+
+def replay(capture_path, age_record_dir, **overrides):
+    config, records = read_capture(capture_path)
+    clock = VirtualClock(config['start_time'])
+    sock = ReplaySocket()
+    destination = make_destination(config, clock, sock, age_record_dir, **overrides)
+    wifresh = isinstance(destination, WiFreshDestination)
+
+    start = time.perf_counter()
+    for direction, time_ns, addr, data, receive_delay in records:
+        clock.now = time_ns
+        if direction == INBOUND:
+            destination.handle_datagram(data, addr, time_ns, time_ns - receive_delay)
+        if wifresh:
+            # The live destination ran a pass at every recorded poll as well
+            destination.advance(time_ns)
+    elapsed = time.perf_counter() - start
+
+    recorded_polls = [(data, addr) for direction, _, addr, data, _ in records if direction == OUTBOUND]
+    replayed_polls = [(data, addr) for data, addr in sock.sent if data.startswith((b'POLL', b'BURST'))]
+    matching_prefix = 0
+    for recorded_poll, replayed_poll in zip(recorded_polls, replayed_polls):
+        if recorded_poll != replayed_poll:
+            break
+        matching_prefix += 1
+    inbound = sum(1 for record in records if record[0] == INBOUND)
+    return {
+        'inbound': inbound,
+        'seconds': elapsed,
+        'recorded_polls': len(recorded_polls),
+        'replayed_polls': len(replayed_polls),
+        'matching_prefix': matching_prefix,
+        'virtual_seconds': (clock.now - config['start_time']) / 1e9,
+        'destination': destination,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a destination capture at maximum speed on a virtual clock')
+    parser.add_argument('capture_file', help='Capture written with --record_file')
+    parser.add_argument('--policy', default=None, help='Replay a WiFresh capture with another scheduling policy')
+    parser.add_argument('--state_backend', choices=['objects', 'numpy'], default=None, help='Replay a WiFresh capture with another state backend')
+    parser.add_argument('--age_record_dir', default='./ages_replay', help='Directory to store the age records of the replay')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random policy')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    overrides = {name: value for name, value in (('policy', args.policy), ('state_backend', args.state_backend)) if value is not None}
+    result = replay(args.capture_file, args.age_record_dir, **overrides)
+    destination = result['destination']
+    print(f"Replayed {result['inbound']} datagrams ({result['virtual_seconds']:.1f} s of capture) in {result['seconds']:.3f} s, "
+          f"{result['inbound'] / max(result['seconds'], 1e-9):.0f} datagrams/s")
+    if isinstance(destination, WiFreshDestination):
+        print(f"Polls: {result['recorded_polls']} recorded, {result['replayed_polls']} replayed, first {result['matching_prefix']} identical")
+    destination.save_ages()
+    print(open(f"{args.age_record_dir}/ages_{len(destination.sources_state)}sources.txt").read(), end='')
@@ -0,0 +1,86 @@
+import re
+import struct
+
+# Delta encoding of successive updates of a stream against the last update the destination holds.
+# A delta is the XOR with the reference update, stored as the runs of non-zero bytes:
+# base update id u32, then per run (offset u32, length u32, bytes). Short zero gaps are kept inside a run,
+# a run header costs more than they do.
+NONE = 0  # Plain update, the destination keeps nothing
+KEYFRAME = 1  # Full update the destination keeps as the reference of the stream
+DELTA = 2  # Runs of the XOR against the reference named by its update id
+
+BASE_ID = struct.Struct('<I')
+RUN = struct.Struct('<II')
+CHANGED_RUNS = re.compile(rb'[^\x00]+(?:\x00{1,8}[^\x00]+)*')
+
+def xor_bytes(a, b):
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+def encode_delta(base_id, reference, data):
+    # Return the delta payload, None if the sizes differ or the delta is not smaller than the update
+    if len(reference) != len(data):
+        return None
+    parts = [BASE_ID.pack(base_id)]
+    size = BASE_ID.size
+    for run in CHANGED_RUNS.finditer(xor_bytes(reference, data)):
+        parts.append(RUN.pack(run.start(), run.end() - run.start()))
+        parts.append(run.group())
+        size += RUN.size + run.end() - run.start()
+        if size >= len(data):
+            return None
+    return b''.join(parts)
+
+def decode_delta(reference, payload):
+    xor = bytearray(len(reference))
+    offset = BASE_ID.size
+    while offset < len(payload):
+        start, length = RUN.unpack_from(payload, offset)
+        offset += RUN.size
+        xor[start:start + length] = payload[offset:offset + length]
+        offset += length
+    return xor_bytes(reference, xor)
+
+class DeltaEncoder:
+    # Source side state of one stream. The poll that takes the next update implicitly acknowledges the previous one;
+    # a destination that could not apply a delta asks for a keyframe in its next poll
+    def __init__(self, keyframe_interval=10):
+        self.keyframe_interval = keyframe_interval  # A keyframe at least every this many updates, 1 sends only keyframes
+        self.reference: tuple = None  # (update id, data) the destination is assumed to hold
+        self.pending: tuple = None  # (update id, data) sent, acknowledged by the next poll
+        self.since_keyframe = 0  # Deltas sent since the last keyframe
+
+    def request_keyframe(self):
+        self.reference = None
+        self.pending = None
+
+    def encode(self, update_id, data):
+        # Return (delta mode, payload) of the update taken by the current poll
+        if self.pending is not None:
+            self.reference = self.pending
+        data = bytes(data)  # The reference outlives a shared-memory slot
+        self.pending = (update_id, data)
+        if self.reference is not None and self.since_keyframe < self.keyframe_interval - 1:
+            payload = encode_delta(self.reference[0], self.reference[1], data)
+            if payload is not None:
+                self.since_keyframe += 1
+                return DELTA, payload
+        self.since_keyframe = 0
+        return KEYFRAME, data
+
+class DeltaDecoder:
+    # Destination side references of every stream that sends keyframes
+    def __init__(self):
+        self.references: dict = {}  # stream -> (update id, data)
+
+    def decode(self, stream, delta, update_id, payload):
+        # Return the full update, None if the reference of a delta is missing
+        if delta == DELTA:
+            reference = self.references.get(stream)
+            if reference is None or reference[0] != BASE_ID.unpack_from(payload)[0]:
+                return None
+            payload = decode_delta(reference[1], payload)
+        self.references[stream] = (update_id, bytes(payload))
+        return payload
+
+    def forget(self, stream):
+        self.references.pop(stream, None)
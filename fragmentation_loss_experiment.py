@@ -0,0 +1,81 @@
+import argparse
+import math
+import multiprocessing
+import random
+import socket
+import time
+from sensor import Sensor, DataType, IP_UDP_HEADER_SIZE
+from wifresh_source import WiFreshSource, IP_MTU_DISCOVER
+from wifresh_destination import WiFreshDestination
+
+# AoI vs. frame loss rate for large updates, fragmenting at the link MTU versus at SO_SNDBUF.
+# Runs on loopback: the source drops each datagram as if it crossed a link with the given MTU and
+# independent per-frame loss, so a datagram the kernel would IP-fragment is lost if any of its frames is.
+
+class FrameLossSource(WiFreshSource):
+    policy_name = 'APP'
+
+    def __init__(self, *args, frame_loss=0.0, link_mtu=1500, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_loss = frame_loss
+        self.link_mtu = link_mtu
+        # Loopback MTU is 64 KiB, keep DF off so the SO_SNDBUF-sized datagrams of the baseline can be sent at all
+        self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, 0)
+
+    def send_packet(self, packet, timestamp, link):
+        datagram_size = len(packet.header_bytes()) + len(packet.data) + 8
+        frames = max(1, math.ceil(datagram_size / (self.link_mtu - 20)))
+        if random.random() < 1 - (1 - self.frame_loss) ** frames:
+            return
+        super().send_packet(packet, timestamp, link)
+
+def run_source(listen_port, destination_port, mtu, frame_loss, link_mtu, image_size):
+    sensor_list = [Sensor(DataType.IMAGE, image_size, 2)]
+    source = FrameLossSource(listen_port, ('127.0.0.1', destination_port), sensor_list, mtu=mtu, frame_loss=frame_loss, link_mtu=link_mtu)
+    source.start()
+
+def run_case(mode, frame_loss, duration, link_mtu, image_size, listen_port, destination_port):
+    if mode == 'mtu':
+        mtu = link_mtu
+    else:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        mtu = probe.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) + IP_UDP_HEADER_SIZE
+        probe.close()
+    source_process = multiprocessing.Process(
+        target=run_source,
+        args=(listen_port, destination_port, mtu, frame_loss, link_mtu, image_size),
+        daemon=True
+    )
+    source_process.start()
+    time.sleep(0.5)
+    destination = WiFreshDestination(
+        sources_addresses=[('127.0.0.1', listen_port, DataType.IMAGE)],
+        listen_port=destination_port,
+        age_record_dir='./ages_fragmentation_loss'
+    )
+    destination.running_period = duration
+    destination.save_ages = lambda: None
+    destination.start()
+    mean_age = list(destination.mean_ages().values())[0]
+    destination.sock.close()
+    source_process.terminate()
+    source_process.join()
+    return mean_age
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure AoI vs. frame loss rate for MTU-sized and SO_SNDBUF-sized fragments')
+    parser.add_argument('--loss_rates', type=float, nargs='+', default=[0.0, 0.01, 0.05, 0.1], help='Per-frame loss rates')
+    parser.add_argument('--duration', type=float, default=10.0, help='Duration of each run in seconds')
+    parser.add_argument('--link_mtu', type=int, default=1500, help='MTU of the emulated link')
+    parser.add_argument('--image_size', type=int, default=19456, help='Size of each IMAGE update in bytes')
+    parser.add_argument('--listen_port', type=int, default=8000, help='Source port')
+    parser.add_argument('--destination_port', type=int, default=9999, help='Destination port')
+    args = parser.parse_args()
+
+    print("loss_rate, mean_aoi_sndbuf_fragments, mean_aoi_mtu_fragments")
+    for frame_loss in args.loss_rates:
+        ages = [
+            run_case(mode, frame_loss, args.duration, args.link_mtu, args.image_size, args.listen_port, args.destination_port)
+            for mode in ('sndbuf', 'mtu')
+        ]
+        print(f"{frame_loss}, {ages[0]}, {ages[1]}")
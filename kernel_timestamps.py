@@ -0,0 +1,23 @@
+import socket
+import struct
+import time
+
+# Linux socket option, not exported by the socket module on every Python version
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+TIMESPEC = struct.Struct('@ll')  # struct timespec: tv_sec, tv_nsec
+ANCILLARY_SIZE = socket.CMSG_SPACE(TIMESPEC.size)
+
+def enable_kernel_timestamps(sock: socket.socket):
+    # The kernel stamps every datagram when it reaches the socket, before it waits in the receive queue
+    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+
+def recv_timestamped(sock: socket.socket, bufsize: int):
+    # Return (data, address, kernel receive time) with the time in ns of time.monotonic_ns(), None if the datagram
+    # carried no timestamp. The kernel stamps CLOCK_REALTIME, mapped with the current realtime - monotonic offset
+    data, ancdata, _, addr = sock.recvmsg(bufsize, ANCILLARY_SIZE)
+    for level, cmsg_type, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and cmsg_type == SCM_TIMESTAMPNS and len(cmsg_data) >= TIMESPEC.size:
+            tv_sec, tv_nsec = TIMESPEC.unpack_from(cmsg_data)
+            return data, addr, tv_sec * 1_000_000_000 + tv_nsec - time.time_ns() + time.monotonic_ns()
+    return data, addr, None
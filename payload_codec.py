@@ -0,0 +1,75 @@
+import lzma
+import zlib
+
+# Payload codecs applied by a WiFresh source to a whole update before fragmentation, undone by the destination
+# after reassembly. The codec id travels in the high nibble of the first header byte, so decoding needs no
+# configuration: the level only matters to the encoder.
+
+class PassthroughCodec:
+    id = 0
+    name = 'none'
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def encode(self, data):
+        return data
+
+    @staticmethod
+    def decode(data):
+        return data
+
+class ZlibCodec:
+    id = 1
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level  # 1 (fastest) to 9 (smallest)
+
+    def encode(self, data):
+        return zlib.compress(data, self.level)
+
+    @staticmethod
+    def decode(data):
+        return zlib.decompress(data)
+
+class LzmaCodec:
+    id = 2
+    name = 'lzma'
+
+    def __init__(self, level=0):
+        self.level = level  # Preset 0 (fastest) to 9 (smallest)
+
+    def encode(self, data):
+        # Raw .xz container is 60+ bytes of framing, FORMAT_ALONE keeps it to 13
+        return lzma.compress(data, format=lzma.FORMAT_ALONE, preset=self.level)
+
+    @staticmethod
+    def decode(data):
+        return lzma.decompress(data, format=lzma.FORMAT_ALONE)
+
+CODECS = {codec.name: codec for codec in (PassthroughCodec, ZlibCodec, LzmaCodec)}
+DECODERS = {codec.id: codec.decode for codec in CODECS.values()}
+
+def make_codec(spec):
+    # 'zlib', 'zlib:9', 'lzma:1' or 'none'
+    name, _, level = spec.partition(':')
+    codec_class = CODECS[name.lower()]
+    return codec_class(int(level)) if level else codec_class()
+
+def encode_payload(codec, data):
+    # Return (codec id, payload), the update goes out uncompressed when the codec does not make it smaller
+    encoded = codec.encode(data)
+    if len(encoded) >= len(data):
+        return PassthroughCodec.id, data
+    return codec.id, encoded
+
+def decode_payload(codec_id, data):
+    # Raise ValueError for an unknown codec or a corrupt payload
+    decoder = DECODERS.get(codec_id)
+    if decoder is None:
+        raise ValueError(f"Unknown payload codec {codec_id}")
+    try:
+        return decoder(data)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Corrupt payload: {e}") from e
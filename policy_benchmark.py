@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+import tracemalloc
+from sensor import DataType
+from wifresh_destination import SourceState
+from scheduling_policy import POLICIES, normalize_stream
+from source_state_table import SourceStateTable, VECTORIZED_POLICIES
+
+# Decision latency and memory of each scheduling policy as the number of streams grows.
+# No sockets: a virtual clock advances by the poll interval, each poll succeeds with probability
+# success_rate, and the destination side of the notifications is emulated on the SourceState.
+
+def make_streams(num_streams):
+    data_types = [data_type for data_type in DataType if data_type.value <= DataType.IMAGE.value]
+    return [normalize_stream((f"10.{idx >> 16 & 0xff}.{idx >> 8 & 0xff}.{idx & 0xff}", 8000, data_types[idx % len(data_types)])) for idx in range(num_streams)]
+
+def make_sources_state(streams, now, state_backend):
+    if state_backend == 'numpy':
+        sources_state = SourceStateTable(streams, now)
+    else:
+        sources_state = {stream: SourceState(now=now) for stream in streams}
+    for stream in streams:
+        sources_state[stream].last_systime_received = now - random.randrange(1_000_000_000)
+    return sources_state
+
+def run_decisions(policy, sources_state, now, decisions, max_seconds, poll_interval, success_rate):
+    # Return (decisions made, total seconds spent in select_source)
+    busy = set()
+    select_time = 0.0
+    deadline = time.perf_counter() + max_seconds
+    for made in range(1, decisions + 1):
+        start = time.perf_counter()
+        stream = policy.select_source(now, busy)
+        select_time += time.perf_counter() - start
+        policy.on_poll_sent(stream, now)
+        now += poll_interval
+        if random.random() < success_rate:
+            sources_state[stream].last_systime_received = now - poll_interval // 2
+            policy.on_update_received(stream, now, True)
+        else:
+            policy.on_poll_timeout(stream, now)
+        if time.perf_counter() >= deadline:
+            break
+    return made, select_time
+
+def benchmark(policy_name, state_backend, num_streams, decisions, max_seconds, poll_interval, success_rate):
+    now = 1_000_000_000_000
+    policies = VECTORIZED_POLICIES if state_backend == 'numpy' else POLICIES
+    streams = make_streams(num_streams)
+    random.seed(num_streams)
+    sources_state = make_sources_state(streams, now, state_backend)
+    policy = policies[policy_name](sources_state)
+    made, select_time = run_decisions(policy, sources_state, now, decisions, max_seconds, poll_interval, success_rate)
+
+    # Same run again under tracemalloc, counting the state table and what the policy allocates on top of it
+    random.seed(num_streams)
+    tracemalloc.start()
+    sources_state = make_sources_state(streams, now, state_backend)
+    state_memory, _ = tracemalloc.get_traced_memory()
+    policy = policies[policy_name](sources_state)
+    run_decisions(policy, sources_state, now, made, float('inf'), poll_interval, success_rate)
+    total_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return select_time / made * 1e6, state_memory / num_streams, (total_memory - state_memory) / 1024, peak_memory / 1024
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure decision latency and memory of the WiFresh scheduling policies')
+    parser.add_argument('--policies', nargs='+', choices=sorted(POLICIES), default=sorted(POLICIES), help='Policies to measure')
+    parser.add_argument('--state_backends', nargs='+', choices=['objects', 'numpy'], default=['objects'], help='Per-stream state backends to measure')
+    parser.add_argument('--num_streams', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000], help='Numbers of streams')
+    parser.add_argument('--decisions', type=int, default=2000, help='Max number of decisions of each run')
+    parser.add_argument('--max_seconds', type=float, default=5.0, help='Max duration of each run in seconds')
+    parser.add_argument('--poll_interval', type=int, default=1_000_000, help='Virtual time between two decisions in nanoseconds')
+    parser.add_argument('--success_rate', type=float, default=0.9, help='Probability that a poll delivers an update')
+    args = parser.parse_args()
+
+    print("policy, state_backend, num_streams, mean_decision_us, state_bytes_per_stream, policy_memory_kib, peak_memory_kib")
+    for policy_name in args.policies:
+        for state_backend in args.state_backends:
+            if state_backend == 'numpy' and policy_name not in VECTORIZED_POLICIES:
+                continue
+            for num_streams in args.num_streams:
+                decision_us, state_bytes, policy_memory, peak_memory = benchmark(
+                    policy_name, state_backend, num_streams, args.decisions, args.max_seconds, args.poll_interval, args.success_rate
+                )
+                print(f"{policy_name}, {state_backend}, {num_streams}, {decision_us:.2f}, {state_bytes:.0f}, {policy_memory:.1f}, {peak_memory:.1f}")
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from sensor import SensorData
+
+class PartialUpdate:
+    def __init__(self, frag_count: int, now: int):
+        self.fragments: list = [None] * frag_count
+        self.received = 0
+        self.last_seen = now
+
+class ReassemblyCache:
+    # Bounded reassembly of fragmented updates keyed by (stream, update id), tolerating reordering.
+    # A stream keeps at most one partial update: a fragment of a newer update drops the older one,
+    # since the source has already moved on. Entries are also dropped after a timeout or evicted LRU first.
+    def __init__(self, max_entries=64, timeout=0.5):
+        self.max_entries = max_entries
+        self.timeout = int(timeout * 1e9)  # Nanoseconds without a new fragment before a partial update is dropped
+        self.entries: OrderedDict = OrderedDict()  # (stream, update_id) -> PartialUpdate, least recently used first
+        self.current_update: dict = {}  # stream -> update id being reassembled
+        self.last_completed: dict = {}  # stream -> last completed update id, to ignore late duplicates
+        self.superseded = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def add(self, stream, fragment: SensorData, now: int):
+        # Return the reassembled payload once the update is complete, None otherwise
+        if fragment.frag_count <= 1:
+            return fragment.data
+        if self.last_completed.get(stream) == fragment.update_id:
+            return None
+        key = (stream, fragment.update_id)
+        current_update = self.current_update.get(stream)
+        if current_update is not None and current_update != fragment.update_id:
+            if self.entries.pop((stream, current_update), None) is not None:
+                self.superseded += 1
+        self.current_update[stream] = fragment.update_id
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = PartialUpdate(fragment.frag_count, now)
+            self.entries[key] = entry
+            if len(self.entries) > self.max_entries:
+                evicted_key, _ = self.entries.popitem(last=False)
+                self.current_update.pop(evicted_key[0], None)
+                self.evicted += 1
+        else:
+            self.entries.move_to_end(key)
+            entry.last_seen = now
+        if fragment.frag_index >= len(entry.fragments) or entry.fragments[fragment.frag_index] is not None:
+            return None
+        entry.fragments[fragment.frag_index] = fragment.data
+        entry.received += 1
+        if entry.received < len(entry.fragments):
+            return None
+        del self.entries[key]
+        del self.current_update[stream]
+        self.last_completed[stream] = fragment.update_id
+        return b''.join(entry.fragments)
+
+    def forget(self, stream):
+        # Drop everything kept for an evicted stream
+        update_id = self.current_update.pop(stream, None)
+        if update_id is not None:
+            self.entries.pop((stream, update_id), None)
+        self.last_completed.pop(stream, None)
+
+    def expire(self, now: int):
+        # Entries are in LRU order, so only the oldest ones need to be checked
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry.last_seen < self.timeout:
+                break
+            del self.entries[key]
+            self.current_update.pop(key[0], None)
+            self.expired += 1
@@ -0,0 +1,34 @@
+class RTTEstimator:
+    # Smoothed RTT and RTT variance kept from poll/response pairs, timeout = SRTT + k * RTTVAR (RFC 6298 style)
+    def __init__(
+        self,
+        initial_timeout=0.3,
+        min_timeout=0.005,
+        max_timeout=1.0,
+        alpha=0.125,
+        beta=0.25,
+        k=4
+    ):
+        self.srtt = None  # Smoothed round-trip time (seconds)
+        self.rttvar = None  # Round-trip time variation (seconds)
+        self.poll_timeout = initial_timeout  # Current timeout of an outstanding poll (seconds)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.timed_out = False  # Last poll timed out, its response may still arrive while the next poll is outstanding
+
+    def add_sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.poll_timeout = min(max(self.srtt + self.k * self.rttvar, self.min_timeout), self.max_timeout)
+
+    def backoff(self):
+        # A timed-out poll doubles the timeout until the next valid sample
+        self.poll_timeout = min(self.poll_timeout * 2, self.max_timeout)
+        self.timed_out = True
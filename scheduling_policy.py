@@ -0,0 +1,263 @@
+import bisect
+import heapq
+import itertools
+import random
+from collections import defaultdict
+from sensor import DataType, DATA_TYPES
+
+# A stream is (ip, port, type value, stream id), the stream id distinguishes several streams of the same type
+# on one source socket. A stream given as (ip, port, DataType) gets the type value as its id. Streams key every
+# per-stream dict, so the type is kept as its int value: an Enum member hashes through Enum.__hash__ in Python
+def normalize_stream(stream):
+    data_type = DataType(stream[2]).value
+    return (stream[0], stream[1], data_type, stream[3] if len(stream) == 4 else data_type)
+
+def stream_label(stream):
+    label = f"{stream[0]}_{stream[1]}_{DATA_TYPES[stream[2]]}"
+    return label if stream[3] == stream[2] else f"{label}_{stream[3]}"
+
+class SchedulingPolicy:
+    # Decides which stream the destination polls next. The destination owns the SourceState of every stream
+    # (age bookkeeping, fragmentation) and notifies the policy of polls, updates and timeouts,
+    # so a policy only keeps the extra state its decision needs. Times are integer nanoseconds of time.monotonic_ns()
+    name = ''  # Name used on the command line
+    label = ''  # Name used for logging
+    liveness_interval = 1_000_000_000  # Max time between polls of a stream whose next update is advertised for later (ns), set by the destination
+
+    def __init__(self, sources_state):
+        self.sources_state = sources_state  # Shared with the destination, read only
+        self.streams = list(sources_state)  # Streams in registration order
+
+    def add_stream(self, stream):
+        # A stream the destination was not configured with started sending
+        self.streams.append(stream)
+
+    def remove_stream(self, stream):
+        # The destination evicted the stream, called before its state is dropped. O(N), eviction is rare
+        self.streams.remove(stream)
+
+    def on_poll_sent(self, stream, now):
+        pass
+
+    def on_update_received(self, stream, now, answered):
+        # A complete new update of the stream was accounted, answered is False for a response to a timed-out poll
+        pass
+
+    def on_poll_timeout(self, stream, now):
+        pass
+
+    def select_source(self, now, busy):
+        # Return the stream to poll next among those whose source address is not in busy, None if there is none
+        raise NotImplementedError
+
+    def suppressed(self, stream, now):
+        # The source advertised the next update of the stream for later: skip it, except for one liveness probe per interval
+        state = self.sources_state[stream]
+        return now < state.next_update_time and now - state.last_poll_time < self.liveness_interval
+
+class APPPolicy(SchedulingPolicy):
+    # WiFresh APP: maximize p * (potential age reduction)^2 over the streams, with p the delivery ratio
+    # of the polls of the last time_period seconds. Every decision recomputes all weights, O(N)
+    name = 'app'
+    label = 'APP'
+
+    def __init__(self, sources_state, time_period=0.5):
+        super().__init__(sources_state)
+        self.time_period = int(time_period * 1e9)  # Window of the delivery ratio (ns), constructor takes seconds
+        self.time_poll_packets: dict = defaultdict(list)
+        self.time_received_packets: dict = defaultdict(list)
+        self.approximate_systime_HOL: dict = defaultdict(float)
+
+    def remove_stream(self, stream):
+        super().remove_stream(stream)
+        self.time_poll_packets.pop(stream, None)
+        self.time_received_packets.pop(stream, None)
+        self.approximate_systime_HOL.pop(stream, None)
+
+    def on_poll_sent(self, stream, now):
+        self.time_poll_packets[stream].append(now)
+
+    def on_update_received(self, stream, now, answered):
+        if answered:
+            # A response to a timed-out poll stays a failure in the delivery ratio
+            self.time_received_packets[stream].append(now)
+        self.approximate_systime_HOL[stream] = now - self.sources_state[stream].last_systime_received
+
+    def weight(self, stream, now):
+        source = self.sources_state[stream]
+        # Drop the polls and receptions that left the time window
+        expired_time = now - self.time_period
+        time_poll_packets = self.time_poll_packets[stream]
+        del time_poll_packets[:bisect.bisect_right(time_poll_packets, expired_time)]
+        time_received_packets = self.time_received_packets[stream]
+        del time_received_packets[:bisect.bisect_right(time_received_packets, expired_time)]
+
+        p = (len(time_received_packets) + 1) / (len(time_poll_packets) + 1)
+        potential_age_reduction = now - source.last_systime_received - self.approximate_systime_HOL[stream]
+        # Normalize by the datagrams still needed to complete an update: the advertised backlog of a
+        # partially delivered update, or the fragment count of the last one for a fresh update
+        airtime_cost = 1 + (source.backlog if source.backlog > 0 else source.update_fragments - 1)
+        return p * potential_age_reduction * potential_age_reduction / airtime_cost
+
+    def select_source(self, now, busy):
+        max_weight, selected_source = None, None
+        for stream in self.streams:
+            if stream[:2] in busy or self.suppressed(stream, now):
+                continue
+            weight = self.weight(stream, now)
+            if selected_source is None or weight > max_weight:
+                max_weight = weight
+                selected_source = stream
+        return selected_source
+
+class MAFPolicy(SchedulingPolicy):
+    # Maximum Age First: the stream whose freshest received update is the oldest. A heap keyed by
+    # last_systime_received gives O(log N) per update, entries made stale by a newer update are dropped lazily
+    name = 'maf'
+    label = 'MAF'
+
+    def __init__(self, sources_state):
+        super().__init__(sources_state)
+        self.counter = itertools.count()  # Tie breaker, streams themselves are not ordered
+        self.heap = [(state.last_systime_received, next(self.counter), stream) for stream, state in sources_state.items()]
+        heapq.heapify(self.heap)
+
+    def add_stream(self, stream):
+        super().add_stream(stream)
+        heapq.heappush(self.heap, (self.sources_state[stream].last_systime_received, next(self.counter), stream))
+
+    def on_update_received(self, stream, now, answered):
+        heapq.heappush(self.heap, (self.sources_state[stream].last_systime_received, next(self.counter), stream))
+
+    def select_source(self, now, busy):
+        # Busy and suppressed streams are set aside and pushed back: at most the poll window of busy ones,
+        # suppressed ones make a decision O(k log N) for k suppressed streams older than the selected one
+        selected_source, skipped = None, []
+        while self.heap:
+            last_systime_received, _, stream = self.heap[0]
+            state = self.sources_state.get(stream)
+            if state is None or last_systime_received != state.last_systime_received:
+                # Made stale by a newer update, or the stream was evicted
+                heapq.heappop(self.heap)
+            elif stream[:2] in busy or self.suppressed(stream, now):
+                skipped.append(heapq.heappop(self.heap))
+            else:
+                selected_source = stream
+                break
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return selected_source
+
+class RoundRobinPolicy(SchedulingPolicy):
+    # Poll the streams in turn, skipping busy ones
+    name = 'round_robin'
+    label = 'Round-robin'
+
+    def __init__(self, sources_state):
+        super().__init__(sources_state)
+        self.next_index = 0
+
+    def select_source(self, now, busy):
+        for _ in range(len(self.streams)):
+            stream = self.streams[self.next_index % len(self.streams)]
+            self.next_index = (self.next_index + 1) % len(self.streams)
+            if stream[:2] not in busy and not self.suppressed(stream, now):
+                return stream
+        return None
+
+class RandomPolicy(SchedulingPolicy):
+    # Poll a uniformly random idle stream. With a small poll window a few draws almost always find one,
+    # a full scan is only the fallback
+    name = 'random'
+    label = 'Random'
+
+    def __init__(self, sources_state, max_draws=8):
+        super().__init__(sources_state)
+        self.max_draws = max_draws
+
+    def select_source(self, now, busy):
+        if not self.streams:
+            return None
+        for _ in range(self.max_draws):
+            stream = random.choice(self.streams)
+            if stream[:2] not in busy and not self.suppressed(stream, now):
+                return stream
+        idle_streams = [stream for stream in self.streams if stream[:2] not in busy and not self.suppressed(stream, now)]
+        return random.choice(idle_streams) if idle_streams else None
+
+class WhittlePolicy(SchedulingPolicy):
+    # Whittle index policy for AoI (Kadota et al.): poll the stream maximizing
+    # w * p * h * (h + 2/p - 1) / 2 = a * h^2 + b * h, with h the age in slots, w the stream weight and p its
+    # channel reliability. The coefficients only depend on (reliability bucket, weight), so they are computed
+    # once per pair and a stream only looks them up again when its reliability moves to another bucket
+    name = 'whittle'
+    label = 'Whittle'
+
+    def __init__(self, sources_state, weights=None, reliability_buckets=20, reliability_gain=0.05):
+        super().__init__(sources_state)
+        # Stream or type value -> weight, a stream falls back to its type, then to 1
+        self.weights = {key.value if isinstance(key, DataType) else normalize_stream(key): weight for key, weight in (weights or {}).items()}
+        self.reliability_buckets = reliability_buckets  # Resolution of the reliability quantization
+        self.reliability_gain = reliability_gain  # EWMA gain of the per-stream poll success ratio
+        self.slot_duration = 1e6  # EWMA of the time between two polls (ns), the unit of h
+        self.last_poll_time: float = None
+        self.coefficients_cache: dict = {}  # (reliability bucket, weight) -> (a, b)
+        self.reliability: dict = {}  # stream -> estimated poll success ratio
+        self.bucket: dict = {}  # stream -> current reliability bucket
+        self.coefficients: dict = {}  # stream -> (a, b) of its current bucket
+        for stream in self.streams:
+            self.set_reliability(stream, 1.0)
+
+    def index_coefficients(self, bucket, weight):
+        coefficients = self.coefficients_cache.get((bucket, weight))
+        if coefficients is None:
+            p = (bucket + 1) / self.reliability_buckets
+            coefficients = (weight * p / 2, weight * (1 - p / 2))
+            self.coefficients_cache[(bucket, weight)] = coefficients
+        return coefficients
+
+    def set_reliability(self, stream, reliability):
+        self.reliability[stream] = reliability
+        bucket = min(int(reliability * self.reliability_buckets), self.reliability_buckets - 1)
+        if self.bucket.get(stream) != bucket:
+            self.bucket[stream] = bucket
+            self.coefficients[stream] = self.index_coefficients(bucket, self.weights.get(stream, self.weights.get(stream[2], 1.0)))
+
+    def add_stream(self, stream):
+        super().add_stream(stream)
+        self.set_reliability(stream, 1.0)
+
+    def remove_stream(self, stream):
+        super().remove_stream(stream)
+        del self.reliability[stream], self.bucket[stream], self.coefficients[stream]
+
+    def on_poll_sent(self, stream, now):
+        if self.last_poll_time is not None and now > self.last_poll_time:
+            self.slot_duration += 0.125 * (now - self.last_poll_time - self.slot_duration)
+        self.last_poll_time = now
+
+    def on_update_received(self, stream, now, answered):
+        if answered:
+            reliability = self.reliability[stream]
+            self.set_reliability(stream, reliability + self.reliability_gain * (1 - reliability))
+
+    def on_poll_timeout(self, stream, now):
+        self.set_reliability(stream, self.reliability[stream] * (1 - self.reliability_gain))
+
+    def select_source(self, now, busy):
+        max_index, selected_source = None, None
+        slots_per_second = 1 / self.slot_duration
+        sources_state = self.sources_state
+        coefficients = self.coefficients
+        for stream in self.streams:
+            if stream[:2] in busy or self.suppressed(stream, now):
+                continue
+            a, b = coefficients[stream]
+            h = (now - sources_state[stream].last_systime_received) * slots_per_second
+            index = h * (a * h + b)
+            if selected_source is None or index > max_index:
+                max_index = index
+                selected_source = stream
+        return selected_source
+
+POLICIES = {policy.name: policy for policy in (APPPolicy, MAFPolicy, RoundRobinPolicy, RandomPolicy, WhittlePolicy)}
@@ -3,6 +3,7 @@ import time
 import json
 import struct
 from enum import Enum
+from typing import List
 
 class DataType(Enum):
     TIME_REQUEST = 0
@@ -10,40 +11,122 @@ class DataType(Enum):
     POSITION = 2
     INERTIAL_MEASUREMENT = 3
     IMAGE = 4
+    BATCH = 5  # Length-delimited records of several streams in one datagram
+
+# 按数值索引的 DataType，解包时用数组下标代替 DataType(...) 查找
+DATA_TYPES = sorted(DataType, key=lambda data_type: data_type.value)
+MAX_STREAM_ID = 0xffff
+# 数据报的IPv4与UDP头部开销，由MTU换算最大负载时使用
+IP_UDP_HEADER_SIZE = 20 + 8
+# 头部中时间戳字段的位置（标志、类型、流编号之后），多目的端发送时只改写这8个字节
+TIMESTAMP_FIELD = struct.Struct('>q')
+TIMESTAMP_OFFSET = 4
+# 可选的负载尾部字段：距本包时间戳的下一次预期更新时间（微秒），首字节第3位表示是否存在
+NEXT_UPDATE_FIELD = struct.Struct('>I')
+MAX_NEXT_UPDATE = 0xffffffff
 
 class SensorData:
-    header_size = 10  # 静态属性，设为10
+    header_size = 20  # 静态属性，设为20
 
     def __init__(
         self, 
         is_fragmented, 
         data_type: DataType, 
-        timestamp: float,
-        data: bytes
+        timestamp: int,
+        data: bytes,
+        update_id: int = 0,
+        frag_index: int = 0,
+        frag_count: int = 1,
+        stream_id: int = None,
+        codec: int = 0,
+        delta: int = 0,
+        next_update: int = None
     ):
-        self.is_fragmented = is_fragmented  # 1个字节，unsigned char，0或1
+        self.is_fragmented = is_fragmented  # 与codec、delta、next_update标志共用1个字节：最低位为0或1
         self.data_type = data_type  # 1个字节，unsigned char，最多8类
-        self.timestamp = timestamp  # 8个字节，float64
+        self.stream_id = data_type.value if stream_id is None else stream_id  # 2个字节，unsigned short，源内逻辑流编号，默认等于类型值
+        self.timestamp = timestamp  # 8个字节，int64，单调时钟纳秒（已换算到目的端时钟）
+        self.update_id = update_id  # 4个字节，unsigned int，同一数据流内的更新序号
+        self.frag_index = frag_index  # 2个字节，unsigned short，分片序号
+        self.frag_count = frag_count  # 2个字节，unsigned short，该更新的分片总数
+        self.codec = codec  # 首字节高4位，负载编码编号（见payload_codec.py），0为不压缩
+        self.delta = delta  # 首字节第1-2位，差分编码模式（见delta_encoding.py），0为完整更新
         self.data = data  # 数据
+        self.next_update = next_update  # 4个字节尾部，距timestamp的下一次预期更新时间（微秒），None为不通告
+        self.header: bytearray = None  # 预先序列化的头部，见ready_header
+
+    @property
+    def backlog(self):
+        # 此分片之后源端还剩余的分片数
+        return self.frag_count - self.frag_index - 1
 
     def to_bytes(self):
+        return self.header_bytes() + self.data + self.trailer_bytes()
+
+    def trailer_bytes(self):
+        return b'' if self.next_update is None else NEXT_UPDATE_FIELD.pack(self.next_update)
+
+    def header_bytes(self):
         # 打包头部
-        header = struct.pack('>BBd', self.is_fragmented, self.data_type.value, self.timestamp)
-        return header + self.data
+        return struct.pack('>BBHqIHH', self.is_fragmented | self.delta << 1 | (self.next_update is not None) << 3 | self.codec << 4, self.data_type.value, self.stream_id, self.timestamp, self.update_id, self.frag_index, self.frag_count)
+
+    def ready_header(self, timestamp: int):
+        # 头部只序列化一次，之后每次发送只用pack_into改写时间戳（可为不同目的端的时钟），其余字段此后不应再修改
+        if self.header is None:
+            self.header = bytearray(self.header_bytes())
+        TIMESTAMP_FIELD.pack_into(self.header, TIMESTAMP_OFFSET, timestamp)
+        return self.header
 
     @staticmethod
     def from_bytes(data_bytes):
-        # 解包头部
+        # 解包头部，截断的数据报或未知的类型抛出 ValueError
+        if len(data_bytes) < SensorData.header_size:
+            raise ValueError(f"Truncated datagram of {len(data_bytes)} bytes")
         header = data_bytes[:SensorData.header_size]
-        is_fragmented, data_type, timestamp = struct.unpack('>BBd', header)
-        data = data_bytes[SensorData.header_size:]
-        return SensorData(is_fragmented, DataType(data_type), timestamp, data)
+        flags, data_type, stream_id, timestamp, update_id, frag_index, frag_count = struct.unpack('>BBHqIHH', header)
+        if data_type >= len(DATA_TYPES):
+            raise ValueError(f"Unknown data type {data_type}")
+        next_update = None
+        if flags & 8:
+            if len(data_bytes) < SensorData.header_size + NEXT_UPDATE_FIELD.size:
+                raise ValueError(f"Truncated datagram of {len(data_bytes)} bytes")
+            next_update, = NEXT_UPDATE_FIELD.unpack_from(data_bytes, len(data_bytes) - NEXT_UPDATE_FIELD.size)
+            data = data_bytes[SensorData.header_size:-NEXT_UPDATE_FIELD.size]
+        else:
+            data = data_bytes[SensorData.header_size:]
+        return SensorData(flags & 1, DATA_TYPES[data_type], timestamp, data, update_id, frag_index, frag_count, stream_id, flags >> 4, flags >> 1 & 3, next_update)
+
+    @staticmethod
+    def pack_batch(records: List['SensorData'], timestamp: int):
+        # 每条记录前加2字节长度
+        payload = b''.join(struct.pack('>H', len(record_bytes)) + record_bytes for record_bytes in (record.to_bytes() for record in records))
+        return SensorData(is_fragmented=0, data_type=DataType.BATCH, timestamp=timestamp, data=payload)
+
+    @staticmethod
+    def unpack_batch(payload: bytes):
+        records = []
+        offset = 0
+        while offset < len(payload):
+            if offset + 2 > len(payload):
+                raise ValueError("Truncated batch record length")
+            record_length, = struct.unpack_from('>H', payload, offset)
+            offset += 2
+            if offset + record_length > len(payload):
+                raise ValueError(f"Batch record of {record_length} bytes overruns the batch")
+            records.append(SensorData.from_bytes(payload[offset:offset + record_length]))
+            offset += record_length
+        return records
+
+    @staticmethod
+    def batch_record_size(data_size):
+        # Bytes a record with data_size payload bytes takes inside a batch
+        return 2 + SensorData.header_size + data_size
 
     def __len__(self):
         return len(self.to_bytes())
 
     def __str__(self):
-        return f"SensorData(is_fragmented={self.is_fragmented}, type={self.data_type}, timestamp={self.timestamp}, data={self.data})"
+        return f"SensorData(is_fragmented={self.is_fragmented}, type={self.data_type}, stream_id={self.stream_id}, timestamp={self.timestamp}, update_id={self.update_id}, fragment={self.frag_index + 1}/{self.frag_count}, codec={self.codec}, delta={self.delta}, next_update={self.next_update}, data={self.data})"
 
 class Sensor:
     def __init__(
@@ -51,24 +134,33 @@ class Sensor:
         data_type: DataType,
         packet_size: int,
         generation_rate: float,
+        stream_id: int = None
     ):
         self.data_type = data_type
+        self.stream_id = data_type.value if stream_id is None else stream_id  # 源内逻辑流编号，同类型多个传感器时需各自指定
         self.packet_size = packet_size  # 增加packet_size属性
         self.data_size = packet_size - SensorData.header_size  # 计算数据部分大小
-        self.generation_interval = 1.0 / generation_rate
-        self.last_generation_time = time.time() - self.generation_interval
+        self.generation_interval = int(1e9 / generation_rate)  # 纳秒
+        self.last_generation_time = time.monotonic_ns() - self.generation_interval
         self.complete_data_queue: list[SensorData] = []
         self.fragment_data_queue: list[SensorData] = []  # FCFS fragment queue
+        self.update_id = 0  # 每次生成数据递增
 
-    def generate_data(self):
-        if time.time() - self.last_generation_time < self.generation_interval:
+    def generate_data(self, now: int = None):
+        # now: 调用方本轮循环缓存的 time.monotonic_ns()
+        if now is None:
+            now = time.monotonic_ns()
+        if now - self.last_generation_time < self.generation_interval:
             return
         # 模拟传感器数据生成
+        self.update_id = (self.update_id + 1) & 0xffffffff
         sensor_data = SensorData(
             is_fragmented=0,
             data_type=self.data_type,  # 示例类型
-            timestamp=time.time(),
-            data=bytes(random.getrandbits(8) for _ in range(self.data_size))
+            timestamp=now,
+            data=bytes(random.getrandbits(8) for _ in range(self.data_size)),
+            update_id=self.update_id,
+            stream_id=self.stream_id
         )
-        self.last_generation_time = time.time()
+        self.last_generation_time = now
         self.complete_data_queue.append(sensor_data)
\ No newline at end of file
@@ -18,19 +18,19 @@ class SensorData:
         self,
         is_fragmented,
         data_type: DataType,
-        timestamp: float,
+        timestamp: int,
         source_id: int,
         data: bytes
     ):
         self.is_fragmented = is_fragmented
         self.data_type = data_type
-        self.timestamp = timestamp
+        self.timestamp = timestamp  # 单调时钟纳秒（已换算到目的端时钟）
         self.source_id = source_id
         self.data = data
 
     def to_bytes(self):
         # 构建消息体（头部 + 数据）
-        header = struct.pack('>BBBd', self.is_fragmented, self.data_type.value, self.source_id, self.timestamp)
+        header = struct.pack('>BBBq', self.is_fragmented, self.data_type.value, self.source_id, self.timestamp)
         payload = header + self.data
         # 计算总长度（不包括长度前缀）
         total_length = len(payload)
@@ -53,7 +53,7 @@ class SensorData:
         header = payload[:SensorData.header_size]
         data = payload[SensorData.header_size:]
         # 解析头部
-        is_fragmented, data_type_value, source_id, timestamp = struct.unpack('>BBBd', header)
+        is_fragmented, data_type_value, source_id, timestamp = struct.unpack('>BBBq', header)
         data_type = DataType(data_type_value)
         # 创建 SensorData 实例
         sensor_data = SensorData(is_fragmented, data_type, timestamp, source_id, data)
@@ -77,22 +77,25 @@ class Sensor:
         self.data_type = data_type
         self.packet_size = packet_size  # 增加packet_size属性
         self.data_size = packet_size - SensorData.header_size  # 计算数据部分大小
-        self.generation_interval = 1.0 / generation_rate
-        self.last_generation_time = time.time() - self.generation_interval
+        self.generation_interval = int(1e9 / generation_rate)  # 纳秒
+        self.last_generation_time = time.monotonic_ns() - self.generation_interval
         self.complete_data_queue: list[SensorData] = []
         self.fragment_data_queue: list[SensorData] = []  # FCFS fragment queue
         self.source_id = source_id
 
-    def generate_data(self):
-        if time.time() - self.last_generation_time < self.generation_interval:
+    def generate_data(self, now: int = None):
+        # now: 调用方本轮循环缓存的 time.monotonic_ns()
+        if now is None:
+            now = time.monotonic_ns()
+        if now - self.last_generation_time < self.generation_interval:
             return
         # 模拟传感器数据生成
         sensor_data = SensorData(
             is_fragmented=0,
             data_type=self.data_type,  # 示例类型
-            timestamp=time.time(),
+            timestamp=now,
             source_id=self.source_id,  # New field
             data=bytes(random.getrandbits(8) for _ in range(self.data_size))
         )
-        self.last_generation_time = time.time()
+        self.last_generation_time = now
         self.complete_data_queue.append(sensor_data)
\ No newline at end of file
@@ -0,0 +1,130 @@
+import atexit
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+from sensor import Sensor, SensorData, DataType
+
+# Ring layout: an 8-byte header with the last committed sequence number, then ring_slots slots of
+# slot header (sequence u64, timestamp i64 monotonic ns, length u32, padding u32) followed by the slot data.
+RING_HEADER = struct.Struct('<Q')
+SLOT_HEADER = struct.Struct('<QqII')
+
+class SensorRing:
+    def __init__(self, slot_data_size: int, ring_slots: int, name: str = None):
+        self.slot_data_size = slot_data_size
+        self.ring_slots = ring_slots
+        self.slot_size = SLOT_HEADER.size + slot_data_size
+        size = RING_HEADER.size + ring_slots * self.slot_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+
+    def slot_offset(self, seq):
+        return RING_HEADER.size + (seq % self.ring_slots) * self.slot_size
+
+    def write(self, seq, timestamp, data):
+        # Seqlock per slot: an odd marker while the slot is being written, the committed sequence afterwards
+        offset = self.slot_offset(seq)
+        SLOT_HEADER.pack_into(self.buf, offset, 2 * seq + 1, timestamp, len(data), 0)
+        data_offset = offset + SLOT_HEADER.size
+        self.buf[data_offset:data_offset + len(data)] = data
+        SLOT_HEADER.pack_into(self.buf, offset, 2 * seq, timestamp, len(data), 0)
+        RING_HEADER.pack_into(self.buf, 0, seq)
+
+    def latest_seq(self):
+        return RING_HEADER.unpack_from(self.buf, 0)[0]
+
+    def read(self, seq):
+        # Return (timestamp, data) of a committed slot, None if it is being rewritten. The data is copied out and
+        # the sequence checked again afterwards: a view would be sent later, when the producer may have reused the slot
+        offset = self.slot_offset(seq)
+        slot_seq, timestamp, length, _ = SLOT_HEADER.unpack_from(self.buf, offset)
+        if slot_seq != 2 * seq:
+            return None
+        data_offset = offset + SLOT_HEADER.size
+        data = bytes(self.buf[data_offset:data_offset + length])
+        if SLOT_HEADER.unpack_from(self.buf, offset)[0] != slot_seq:
+            return None
+        return timestamp, data
+
+    def close(self):
+        self.buf.release()
+        self.shm.close()
+
+def exit_on_sigterm(signum, frame):
+    # The default SIGTERM action skips atexit, so the producers and rings of the shared-memory sensors would leak
+    sys.exit(128 + signum)
+
+def run_producer(shm_name, slot_data_size, ring_slots, data_size, generation_rate, parent_pid):
+    # Separate process doing the (simulated) capture, so that it never blocks POLL handling in the source
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    ring = SensorRing(slot_data_size, ring_slots, name=shm_name)
+    generation_interval = int(1e9 / generation_rate)
+    seq = 0
+    next_generation_time = time.monotonic_ns()
+    # Stop once the source is gone, e.g. killed before it could terminate its producers
+    while os.getppid() == parent_pid:
+        sleep_time = next_generation_time - time.monotonic_ns()
+        if sleep_time > 0:
+            time.sleep(sleep_time / 1e9)
+        next_generation_time += generation_interval
+        seq += 1
+        ring.write(seq, time.monotonic_ns(), os.urandom(data_size))
+
+class SharedMemorySensor(Sensor):
+    # Sensor backend whose updates are produced by another process into a multiprocessing.shared_memory ring.
+    # The newest slot is copied out when the source picks it up, a slot rewritten meanwhile is retried on the next pass.
+    # The producers are terminated and the ring unlinked at exit, including on SIGTERM.
+    def __init__(
+        self,
+        data_type: DataType,
+        packet_size: int,
+        generation_rate: float,
+        ring_slots=8,
+        stream_id: int = None
+    ):
+        super().__init__(data_type, packet_size, generation_rate, stream_id)
+        self.ring = SensorRing(self.data_size, ring_slots)
+        self.last_seq = 0  # Last sequence number handed to the source
+        self.producer = multiprocessing.Process(
+            target=run_producer,
+            args=(self.ring.shm.name, self.data_size, ring_slots, self.data_size, generation_rate, os.getpid()),
+            daemon=True
+        )
+        self.producer.start()
+        atexit.register(self.close)
+        if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+    def generate_data(self, now: int = None):
+        # Publish the newest committed slot, older unread slots are skipped (LCFS)
+        seq = self.ring.latest_seq()
+        if seq == self.last_seq:
+            return
+        slot = self.ring.read(seq)
+        if slot is None:
+            return
+        timestamp, data = slot
+        self.last_seq = seq
+        self.last_generation_time = timestamp
+        self.update_id = seq & 0xffffffff
+        self.complete_data_queue.clear()
+        self.complete_data_queue.append(SensorData(is_fragmented=0, data_type=self.data_type, timestamp=timestamp, data=data, update_id=self.update_id, stream_id=self.stream_id))
+
+    def close(self):
+        if self.producer.is_alive():
+            self.producer.terminate()
+            self.producer.join()
+        self.complete_data_queue.clear()
+        self.fragment_data_queue.clear()
+        try:
+            self.ring.shm.unlink()
+            self.ring.close()
+        except (BufferError, FileNotFoundError):
+            pass
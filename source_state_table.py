@@ -0,0 +1,267 @@
+import math
+from collections.abc import Mapping
+try:
+    import numpy as np
+except ImportError:  # Optional, only the numpy state backend needs it
+    np = None
+from scheduling_policy import SchedulingPolicy, POLICIES, stream_label
+
+# Struct-of-arrays replacement for the dict of SourceState objects of a WiFresh destination.
+# Every stream gets a dense id, each attribute is one NumPy column: 69 bytes per stream. Times are int32 microseconds
+# after a base that follows the clock and durations int32 microseconds, both saturating at about 35 minutes; only
+# the generation time of the freshest update stays exact, as it decides which updates are fresh. With the
+# stream -> id dict and the id -> stream list a stream takes about 160 bytes against about 280 for a SourceState
+# (policy_benchmark.py, 100k streams), the stream tuples themselves not counted: the two Python containers alone
+# take about 90 bytes per stream.
+TIME, DEADLINE, DURATION = 'time', 'deadline', 'duration'
+COLUMNS = [
+    ('last_systime_received', 'int64', None),  # Generation time of the freshest received update (ns)
+    ('last_received_time', 'int32', TIME),  # Reception time of that update
+    ('last_recorded_age', 'int32', DURATION),  # Age right after that update
+    ('peak_age', 'int32', DURATION),  # Largest age reached right before an update
+    ('total_weighted_ages', 'float64', None),  # Integral of the age (ns^2), float as it outgrows int64 within minutes
+    ('approximate_systime_HOL', 'int32', DURATION),  # Age of the freshest update when it was received
+    ('count_time', 'int32', TIME),  # Time poll_count and received_count were last decayed to
+    ('poll_count', 'float32', None),  # Exponentially decayed number of polls
+    ('received_count', 'float32', None),  # Exponentially decayed number of updates answering a poll
+    ('next_update_time', 'int32', DEADLINE),  # Next update time advertised by the source, long past if unknown
+    ('last_poll_time', 'int32', TIME),  # Time of the last poll granting the stream
+    ('polls', 'uint32', None),  # Polls granting the stream
+    ('delivered', 'uint32', None),  # Updates accounted in the age
+    ('backlog', 'uint16', None),  # Remaining fragments the source advertised in its last response
+    ('update_fragments', 'uint16', None),  # Number of datagrams the last complete update needed
+    ('fragmented', 'bool', None),  # Whether the last complete update needed more than one datagram
+    ('source_key', 'uint32', None),  # Low 32 bits of hash() of the (ip, port) of the stream, busy sources are masked by it
+]
+INT32_MIN, INT32_MAX = -(1 << 31), (1 << 31) - 1
+# A TIME written more than this after the base (us, about 18 minutes) moves the base to it
+REBASE_AFTER = 1 << 30
+
+def column_property(name, kind):
+    # TIME and DEADLINE columns hold microseconds after the base, DURATION columns microseconds, the views
+    # read and write nanoseconds like SourceState. Only a TIME, written with the current time, moves the base
+    if kind is None:
+        def get(self):
+            return self.table.columns[name][self.idx].item()
+
+        def set(self, value):
+            self.table.columns[name][self.idx] = value
+    elif kind == DURATION:
+        def get(self):
+            return int(self.table.columns[name][self.idx]) * 1000
+
+        def set(self, value):
+            self.table.columns[name][self.idx] = to_duration(value)
+    else:
+        def get(self):
+            return self.table.to_time(self.table.columns[name][self.idx])
+
+        def set(self, value):
+            self.table.columns[name][self.idx] = self.table.to_relative(value, kind == TIME)
+    return property(get, set)
+
+def to_duration(duration):
+    return max(INT32_MIN, min(duration // 1000, INT32_MAX))
+
+class SourceStateRow:
+    # View on one stream of a SourceStateTable with the attributes of SourceState,
+    # so the per-update code of the destination is the same for both backends.
+    # Built on demand by SourceStateTable[stream], valid until the table removes a stream
+    __slots__ = ('table', 'idx')
+
+    def __init__(self, table, idx):
+        self.table = table
+        self.idx = idx
+
+    @property
+    def stream(self):
+        return self.table.streams[self.idx]
+
+for column_name, _, column_kind in COLUMNS:
+    setattr(SourceStateRow, column_name, column_property(column_name, column_kind))
+
+class SourceStateTable(Mapping):
+    def __init__(self, streams, now: int):
+        if np is None:
+            raise ImportError("The numpy state backend requires NumPy")
+        self.capacity = max(len(streams), 16)
+        self.size = 0
+        self.base = now  # Time (ns) the TIME and DEADLINE columns count from
+        self.columns = {name: np.zeros(self.capacity, dtype=dtype) for name, dtype, _ in COLUMNS}
+        self.ids: dict = {}  # Stream -> dense id
+        self.streams: list = []  # Dense id -> stream
+        for stream in streams:
+            self.add(stream, now)
+
+    def add(self, stream, now: int):
+        if self.size == self.capacity:
+            self.capacity *= 2
+            for name, values in self.columns.items():
+                self.columns[name] = np.resize(values, self.capacity)
+        idx = self.size
+        self.size += 1
+        for values in self.columns.values():
+            values[idx] = 0
+        relative_now = self.to_relative(now, True)
+        self.columns['last_systime_received'][idx] = now
+        self.columns['last_received_time'][idx] = relative_now
+        self.columns['count_time'][idx] = relative_now
+        self.columns['last_poll_time'][idx] = relative_now
+        self.columns['next_update_time'][idx] = INT32_MIN
+        self.columns['update_fragments'][idx] = 1
+        self.columns['source_key'][idx] = hash(stream[:2]) & 0xffffffff
+        self.ids[stream] = idx
+        self.streams.append(stream)
+
+    def remove(self, stream):
+        # Move the last row into the freed one, so the columns stay dense
+        idx = self.ids.pop(stream)
+        last = self.size - 1
+        if idx != last:
+            for values in self.columns.values():
+                values[idx] = values[last]
+            moved_stream = self.streams[last]
+            self.streams[idx] = moved_stream
+            self.ids[moved_stream] = idx
+        self.streams.pop()
+        self.size -= 1
+
+    def to_relative(self, time: int, moves_base=False):
+        # Microseconds after the base, saturating. The base only moves for the current time, a deadline is clamped
+        relative = (time - self.base) // 1000
+        if moves_base and relative > REBASE_AFTER:
+            self.rebase(time)
+            relative = (time - self.base) // 1000
+        return max(INT32_MIN, min(relative, INT32_MAX))
+
+    def to_time(self, relative):
+        return self.base + int(relative) * 1000
+
+    def rebase(self, time: int):
+        # Whole microseconds, so the times that stay in range are not rounded again
+        shift = (time - self.base) // 1000
+        self.base += shift * 1000
+        for name, _, kind in COLUMNS:
+            if kind in (TIME, DEADLINE):
+                values = self.column(name)
+                values[:] = np.maximum(values.astype(np.int64) - shift, INT32_MIN)
+
+    def column(self, name):
+        # Column restricted to the streams in use
+        return self.columns[name][:self.size]
+
+    def times(self, name):
+        # TIME or DEADLINE column in nanoseconds
+        return self.base + self.column(name).astype(np.int64) * 1000
+
+    def durations(self, name):
+        # DURATION column in nanoseconds
+        return self.column(name).astype(np.int64) * 1000
+
+    def __getitem__(self, stream):
+        return SourceStateRow(self, self.ids[stream])
+
+    def __contains__(self, stream):
+        return stream in self.ids
+
+    def __iter__(self):
+        return iter(self.streams)
+
+    def __len__(self):
+        return self.size
+
+    def mean_ages(self, now: int, start_time: int):
+        # Close the age integral of every stream at once, mean ages in seconds
+        last_systime_received = self.column('last_systime_received').astype(np.float64)
+        last_recorded_age = self.durations('last_recorded_age').astype(np.float64)
+        last_received_time = self.times('last_received_time').astype(np.float64)
+        total_weighted_ages = self.column('total_weighted_ages')
+        total_weighted_ages += (last_recorded_age + now - last_systime_received) * (now - last_received_time) // 2
+        mean_ages = total_weighted_ages / (now - start_time) / 1e9
+        return {stream_label(stream): mean_age for stream, mean_age in zip(self.streams, mean_ages.tolist())}
+
+class VectorizedPolicy(SchedulingPolicy):
+    def __init__(self, sources_state: SourceStateTable):
+        super().__init__(sources_state)
+        self.table = sources_state
+
+    def mask_busy(self, scores, busy, masked_value):
+        # A hash collision with a busy source only sets a stream aside for this decision
+        if busy:
+            scores[np.isin(self.table.column('source_key'), [hash(address) & 0xffffffff for address in busy])] = masked_value
+
+    def mask_suppressed(self, scores, now, masked_value):
+        # Streams whose next update is advertised for later and that were polled within the liveness interval
+        suppressed = (self.table.times('next_update_time') > now) & (now - self.table.times('last_poll_time') < self.liveness_interval)
+        scores[suppressed] = masked_value
+
+class VectorizedAPPPolicy(VectorizedPolicy):
+    # WiFresh APP weight of every stream in one pass over the columns. The delivery ratio comes from
+    # poll and reception counts decayed with time constant time_period, instead of per-stream timestamp windows
+    name = 'app'
+    label = 'APP'
+
+    def __init__(self, sources_state: SourceStateTable, time_period=0.5):
+        super().__init__(sources_state)
+        self.time_period = int(time_period * 1e9)  # Decay time constant (ns), constructor takes seconds
+
+    def decay_counts(self, idx, now):
+        table = self.table
+        columns = table.columns
+        decay = math.exp((table.to_time(columns['count_time'][idx]) - now) / self.time_period)
+        columns['poll_count'][idx] *= decay
+        columns['received_count'][idx] *= decay
+        columns['count_time'][idx] = table.to_relative(now, True)
+
+    def on_poll_sent(self, stream, now):
+        idx = self.table.ids[stream]
+        self.decay_counts(idx, now)
+        self.table.columns['poll_count'][idx] += 1
+
+    def on_update_received(self, stream, now, answered):
+        idx = self.table.ids[stream]
+        columns = self.table.columns
+        self.decay_counts(idx, now)
+        if answered:
+            # A response to a timed-out poll stays a failure in the delivery ratio
+            columns['received_count'][idx] += 1
+        columns['approximate_systime_HOL'][idx] = to_duration(now - int(columns['last_systime_received'][idx]))
+
+    def select_source(self, now, busy):
+        table = self.table
+        if not table.size:
+            return None
+        decay = np.exp((table.times('count_time') - now) / self.time_period)
+        p = (table.column('received_count') * decay + 1) / (table.column('poll_count') * decay + 1)
+        potential_age_reduction = (now - table.column('last_systime_received') - table.durations('approximate_systime_HOL')).astype(np.float64)
+        backlog = table.column('backlog')
+        airtime_cost = 1 + np.where(backlog > 0, backlog, table.column('update_fragments').astype(np.int32) - 1)
+        weights = p * potential_age_reduction * potential_age_reduction / airtime_cost
+        self.mask_busy(weights, busy, -np.inf)
+        self.mask_suppressed(weights, now, -np.inf)
+        idx = int(np.argmax(weights))
+        return None if weights[idx] == -np.inf else table.streams[idx]
+
+class VectorizedMAFPolicy(VectorizedPolicy):
+    # Maximum Age First as one argmin over the last_systime_received column
+    name = 'maf'
+    label = 'MAF'
+
+    def select_source(self, now, busy):
+        table = self.table
+        if not table.size:
+            return None
+        last_systime_received = table.column('last_systime_received').copy()
+        self.mask_busy(last_systime_received, busy, np.iinfo(np.int64).max)
+        self.mask_suppressed(last_systime_received, now, np.iinfo(np.int64).max)
+        idx = int(np.argmin(last_systime_received))
+        if last_systime_received[idx] == np.iinfo(np.int64).max:
+            return None
+        return table.streams[idx]
+
+# Policies of the numpy backend, round-robin and random work on the row views of the generic implementation.
+# Whittle is left out: its per-stream scan through row views is several times slower than on SourceState objects
+VECTORIZED_POLICIES = dict(
+    {name: policy for name, policy in POLICIES.items() if name != 'whittle'},
+    **{policy.name: policy for policy in (VectorizedAPPPolicy, VectorizedMAFPolicy)}
+)
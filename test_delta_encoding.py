@@ -0,0 +1,38 @@
+from delta_encoding import DeltaEncoder, DeltaDecoder, KEYFRAME, DELTA
+
+def encode_modes(keyframe_interval, updates):
+    encoder = DeltaEncoder(keyframe_interval)
+    data = bytearray(64)
+    modes = []
+    for update_id in range(1, updates + 1):
+        data[update_id % len(data)] = update_id  # A small change, always worth a delta
+        modes.append(encoder.encode(update_id, data)[0])
+    return modes
+
+def test_keyframe_every_interval():
+    modes = encode_modes(3, 9)
+    assert [idx for idx, mode in enumerate(modes) if mode == KEYFRAME] == [0, 3, 6]
+
+def test_interval_one_sends_only_keyframes():
+    assert encode_modes(1, 4) == [KEYFRAME] * 4
+
+def test_keyframe_request_restarts_the_interval():
+    encoder = DeltaEncoder(4)
+    data = bytearray(64)
+    assert encoder.encode(1, data)[0] == KEYFRAME
+    data[0] = 1
+    assert encoder.encode(2, data)[0] == DELTA
+    encoder.request_keyframe()
+    modes = []
+    for update_id in range(3, 8):
+        data[update_id] = update_id
+        modes.append(encoder.encode(update_id, data)[0])
+    assert modes == [KEYFRAME, DELTA, DELTA, DELTA, KEYFRAME]
+
+def test_decoder_rebuilds_deltas():
+    encoder, decoder = DeltaEncoder(10), DeltaDecoder()
+    data = bytearray(range(64))
+    for update_id in range(1, 6):
+        data[update_id * 7] ^= 0xff
+        mode, payload = encoder.encode(update_id, data)
+        assert decoder.decode('stream', mode, update_id, payload) == bytes(data)
@@ -0,0 +1,47 @@
+import argparse
+from collections import defaultdict
+from update_trace import read_trace, GENERATED, DEQUEUED, SENT, RECEIVED, ACCEPTED
+
+# Break the age of the traced updates at delivery down per stream:
+# queueing in the source LCFS queue until a poll takes it (generated -> dequeued), delivery of its remaining
+# fragments on later polls (dequeued -> sent), the network including clock sync error (sent -> received)
+# and destination processing (received -> accepted). The age right after an accepted update is their sum,
+# the rest of the AoI comes from the time between accepted updates.
+COMPONENTS = [
+    ('source_queueing', GENERATED, DEQUEUED),
+    ('fragment_delivery', DEQUEUED, SENT),
+    ('network', SENT, RECEIVED),
+    ('destination', RECEIVED, ACCEPTED),
+]
+
+def breakdown(trace_paths):
+    # Return {(ip, port, stream id): (traced updates, {component: mean ns}, mean age at delivery ns)}
+    stamps = defaultdict(dict)  # (ip, port, stream id, update id) -> event -> time
+    for trace_path in trace_paths:
+        for event, ip, port, stream_id, update_id, time_ns in read_trace(trace_path):
+            # A retransmitted or superseded update keeps its first stamp of each event
+            stamps[(ip, port, stream_id, update_id)].setdefault(event, time_ns)
+    totals = defaultdict(lambda: defaultdict(int))
+    counts = defaultdict(int)
+    for (ip, port, stream_id, _), events in stamps.items():
+        if len(events) < len(COMPONENTS) + 1:
+            # Not accepted (stale or lost), or a stamp was dropped
+            continue
+        stream = (ip, port, stream_id)
+        counts[stream] += 1
+        for name, start_event, end_event in COMPONENTS:
+            totals[stream][name] += events[end_event] - events[start_event]
+        totals[stream]['age'] += events[ACCEPTED] - events[GENERATED]
+    return {
+        stream: (count, {name: totals[stream][name] / count for name, _, _ in COMPONENTS}, totals[stream]['age'] / count)
+        for stream, count in sorted(counts.items())
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Break the age of traced updates down into source, network and destination components')
+    parser.add_argument('trace_files', nargs='+', help='Trace files of the sources and of the destination (--trace_file)')
+    args = parser.parse_args()
+
+    print(f"stream, traced_updates, {', '.join(f'{name}_ms' for name, _, _ in COMPONENTS)}, age_at_delivery_ms")
+    for (ip, port, stream_id), (count, components, age) in breakdown(args.trace_files).items():
+        print(f"{ip}_{port}_{stream_id}, {count}, {', '.join(f'{components[name] / 1e6:.3f}' for name, _, _ in COMPONENTS)}, {age / 1e6:.3f}")
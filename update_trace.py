@@ -0,0 +1,77 @@
+import socket
+import struct
+import threading
+
+# Per-update latency stamps of a sampled fraction of the updates. Sources and destination decide
+# independently from the update id whether an update is sampled, so both sides trace the same updates.
+# All times are integer nanoseconds of the destination's monotonic clock, sources map theirs with the clock offset.
+GENERATED = 0  # Generation time of the update
+DEQUEUED = 1  # Taken from the LCFS complete_data_queue to answer a poll
+SENT = 2  # Last datagram of the update handed to the kernel
+RECEIVED = 3  # Last datagram of the update received by the destination
+ACCEPTED = 4  # Update accounted in the age of its stream
+EVENT_NAMES = ['generated', 'dequeued', 'sent', 'received', 'accepted']
+
+# event u8, stream id u16, source port u16, source IPv4 address, update id u32, time i64
+RECORD = struct.Struct('<BHH4sIq')
+
+class UpdateTracer:
+    # Stamps go into a preallocated ring that a background thread appends to trace_path every flush_interval,
+    # the traced loop never blocks on the file. Stamps overwritten before they were flushed are counted as dropped
+    def __init__(self, trace_path, sample_fraction=0.01, capacity=8192, flush_interval=0.5):
+        self.threshold = int(sample_fraction * (1 << 32))
+        self.capacity = capacity
+        self.ring = bytearray(capacity * RECORD.size)
+        self.write_count = 0  # Stamps written since the start, the ring slot is write_count % capacity
+        self.flush_count = 0  # Stamps written to the file or dropped
+        self.dropped = 0
+        self.file = open(trace_path, 'ab')
+        self.flush_interval = flush_interval
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+        self.flusher.start()
+
+    def sampled(self, update_id):
+        # Multiplicative hash of the update id, update id 0 marks responses without an update
+        return update_id != 0 and (update_id * 2654435761) & 0xffffffff < self.threshold
+
+    def stamp(self, event, ip, port, stream_id, update_id, time_ns):
+        offset = (self.write_count % self.capacity) * RECORD.size
+        RECORD.pack_into(self.ring, offset, event, stream_id, port, socket.inet_aton(ip), update_id, time_ns)
+        self.write_count += 1
+
+    def flush(self):
+        end = self.write_count
+        start = max(self.flush_count, end - self.capacity)
+        self.dropped += start - self.flush_count
+        first, last = start % self.capacity * RECORD.size, end % self.capacity * RECORD.size
+        if start == end:
+            chunk = b''
+        elif first < last:
+            chunk = bytes(self.ring[first:last])
+        else:
+            chunk = bytes(self.ring[first:]) + bytes(self.ring[:last])
+        # Slots the writer reused while they were being copied
+        overwritten = min(self.write_count - self.capacity - start, end - start)
+        if overwritten > 0:
+            chunk = chunk[overwritten * RECORD.size:]
+            self.dropped += overwritten
+        self.file.write(chunk)
+        self.file.flush()
+        self.flush_count = end
+
+    def run_flusher(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+        self.file.close()
+
+def read_trace(trace_path):
+    with open(trace_path, 'rb') as trace_file:
+        data = trace_file.read()
+    for event, stream_id, port, ip, update_id, time_ns in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+        yield event, socket.inet_ntoa(ip), port, stream_id, update_id, time_ns
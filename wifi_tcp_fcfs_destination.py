@@ -8,11 +8,14 @@ from typing import List, Tuple
 from sensor_for_tcp import DataType, SensorData
 
 class SourceState:
-    def __init__(self):
+    # Times are integer nanoseconds of the destination's time.monotonic_ns(), source timestamps are mapped onto it
+    def __init__(self, now: int = None):
+        if now is None:
+            now = time.monotonic_ns()
         self.weight: float = 0
-        self.last_systime_received: float = time.time()
-        self.last_recorded_age = 0.0
-        self.total_weighted_ages: float = 0.0
+        self.last_systime_received: int = now
+        self.last_recorded_age = 0
+        self.total_weighted_ages: int = 0  # Integral of the age (ns^2)
 
 class WiFiTCPFcfsDestination:
     def __init__(
@@ -25,15 +28,15 @@ class WiFiTCPFcfsDestination:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.bind(('0.0.0.0', listen_port))
         self.sock.listen()
+        self.start_time = time.monotonic_ns()
         self.sources_state: dict[Tuple[int, DataType], SourceState] = {}
         self.age_record_dir = age_record_dir
         os.makedirs(age_record_dir, exist_ok=True)
         for source_id, data_type in sources_addresses:
-            self.sources_state[(source_id, data_type)] = SourceState()
+            self.sources_state[(source_id, data_type)] = SourceState(now=self.start_time)
             print(f"Added source {source_id} {data_type}")
         self.age_record_interval = age_record_interval
-        self.last_age_record_time = time.time() - self.age_record_interval
-        self.start_time = time.time()
+        self.last_age_record_time = self.start_time - int(self.age_record_interval * 1e9)
         self.running_period = 600.0
         self.client_sockets = []
         self.recv_buffers = {}  # Key: socket, Value: bytearray
@@ -42,11 +45,13 @@ class WiFiTCPFcfsDestination:
         print("WiFi TCP FCFS destination started")
         self.sock.setblocking(False)
         while True:
+            # One clock read per pass, integer nanoseconds of the monotonic clock
+            now = time.monotonic_ns()
             self.accept_connections()
-            self.receive_data()
-            if time.time() - self.last_age_record_time >= self.age_record_interval:
-                self.record_age()
-            if time.time() - self.start_time >= self.running_period:
+            self.receive_data(now)
+            if now - self.last_age_record_time >= self.age_record_interval * 1e9:
+                self.record_age(now)
+            if now - self.start_time >= self.running_period * 1e9:
                 self.save_ages()
                 print("WiFi TCP FCFS destination stopped")
                 break
@@ -66,22 +71,21 @@ class WiFiTCPFcfsDestination:
         with open(record_file_path, 'w') as record_file:
             mean_ages = []
             for source_address, source in self.sources_state.items():
-                mean_age = source.total_weighted_ages / self.running_period
+                mean_age = source.total_weighted_ages / (self.running_period * 1e9) / 1e9
                 record_file.write(f"{source_address[0]}_{source_address[1]}: {mean_age}\n")
                 mean_ages.append(mean_age)
             if mean_ages:
                 record_file.write(f"Mean AOI of all data sources: {sum(mean_ages) / len(mean_ages)}\n")
 
-    def record_age(self):
+    def record_age(self, now):
         for source in self.sources_state.values():
-            current_time = time.time()
-            age = current_time - source.last_systime_received
-            age_area = (age + source.last_recorded_age) * (current_time - self.last_age_record_time) / 2
+            age = now - source.last_systime_received
+            age_area = (age + source.last_recorded_age) * (now - self.last_age_record_time) // 2
             source.total_weighted_ages += age_area
             source.last_recorded_age = age
-        self.last_age_record_time = time.time()
+        self.last_age_record_time = now
 
-    def receive_data(self):
+    def receive_data(self, now):
         if not self.client_sockets:
             return
         readable, _, exceptional = select.select(self.client_sockets, [], self.client_sockets, 0)
@@ -94,13 +98,13 @@ class WiFiTCPFcfsDestination:
                 # Add received data to buffer
                 self.recv_buffers[sock].extend(data_bytes)
                 # Process complete messages in buffer
-                self.process_buffer(sock)
+                self.process_buffer(sock, now)
             except ConnectionResetError:
                 self.close_connection(sock)
         for sock in exceptional:
             self.close_connection(sock)
 
-    def process_buffer(self, sock):
+    def process_buffer(self, sock, now):
         buffer = self.recv_buffers[sock]
         while True:
             if len(buffer) < 4:
@@ -121,9 +125,9 @@ class WiFiTCPFcfsDestination:
                     print("Failed to parse SensorData from bytes")
                     continue
                 if data_structed.data_type == DataType.TIME_REQUEST:
-                    self.handle_time_request(sock, data_structed)
+                    self.handle_time_request(sock, data_structed, now)
                 else:
-                    self.process_fragment(data_structed)
+                    self.process_fragment(data_structed, now)
             except Exception as e:
                 print(f"Error parsing message: {e}")
                 continue
@@ -134,10 +138,9 @@ class WiFiTCPFcfsDestination:
         del self.recv_buffers[sock]
         sock.close()
 
-    def handle_time_request(self, sock, data_structed):
+    def handle_time_request(self, sock, data_structed, current_time):
         source_time = data_structed.timestamp
-        current_time = time.time()
-        response = f"TIME_RESPONSE:{current_time:010.15f}:{source_time:010.15f}"
+        response = f"TIME_RESPONSE:{current_time}:{source_time}"
         response_bytes = response.encode()
         total_length = len(response_bytes)
         length_prefix = struct.pack('>I', total_length)
@@ -149,13 +152,13 @@ class WiFiTCPFcfsDestination:
             self.close_connection(sock)
             print(f"Error sending TIME_RESPONSE to {sock.getpeername()}")
 
-    def process_fragment(self, fresh_data: SensorData):
+    def process_fragment(self, fresh_data: SensorData, now):
         if fresh_data is None:
             return
         source_key = (fresh_data.source_id, fresh_data.data_type)
         source = self.sources_state.get(source_key)
         if source:
-            fresh_data.timestamp = max(fresh_data.timestamp, time.time())
+            fresh_data.timestamp = max(fresh_data.timestamp, now)
             if source.last_systime_received < fresh_data.timestamp:
                 source.last_systime_received = fresh_data.timestamp
         else:
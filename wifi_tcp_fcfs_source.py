@@ -4,6 +4,7 @@ import time
 import struct
 from typing import List
 from sensor_for_tcp import Sensor, SensorData, DataType
+from clock_sync import ClockSynchronizer
 
 class WiFiTCPFcfsSource:
     def __init__(
@@ -12,20 +13,15 @@ class WiFiTCPFcfsSource:
         destination_address,
         source_id,          # For identifying the source
         sensor_list: List[Sensor],
-        sync_interval=5,
-        sync_rounds=5,
-        clock_offset_alpha=0.02
+        min_sync_interval=1.0,
+        max_sync_interval=64.0
     ):
         self.listen_port = listen_port
         self.destination_address = destination_address
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.bind(('0.0.0.0', self.listen_port))
         self.sensor_list = sensor_list
-        self.clock_offset = 0.0
-        self.sync_interval = sync_interval
-        self.last_sync_time = time.time()
-        self.sync_rounds = sync_rounds
-        self.clock_offset_alpha = clock_offset_alpha
+        self.clock_sync = ClockSynchronizer(min_sync_interval, max_sync_interval)
         self.connected = False
         self.recv_buffer = bytearray()
         self.source_id = source_id  # New field
@@ -48,29 +44,32 @@ class WiFiTCPFcfsSource:
         self.connect_to_destination()
         print(f"WiFi TCP FCFS source started on port {self.listen_port}")
         while True:
-            self.receive_response()
-            if time.time() - self.last_sync_time >= self.sync_interval:
-                self.clock_synchronization()
+            # One clock read per pass, integer nanoseconds of the monotonic clock
+            now = time.monotonic_ns()
+            self.receive_response(now)
+            if self.clock_sync.due(now):
+                self.clock_synchronization(now)
+            clock_offset = self.clock_sync.offset(now)
             for sensor in self.sensor_list:
-                sensor.generate_data()
+                sensor.generate_data(now)
                 if sensor.complete_data_queue:
                     oldest_data = sensor.complete_data_queue[0]
-                    oldest_data.timestamp += self.clock_offset
+                    oldest_data.timestamp += clock_offset
                     try:
                         self.send_packet(oldest_data)
                         sensor.complete_data_queue.pop(0)
                     except BlockingIOError:
                         # print("BlockingIOError while sending data")
-                        oldest_data.timestamp -= self.clock_offset
+                        oldest_data.timestamp -= clock_offset
 
-    def receive_response(self):
+    def receive_response(self, now):
         try:
             data = self.sock.recv(4096)
             if data:
                 # Add received data to the buffer
                 self.recv_buffer.extend(data)
                 # Process complete messages in the buffer
-                self.process_buffer()
+                self.process_buffer(now)
             else:
                 print("Received empty data, reconnecting...")
                 self.connected = False
@@ -82,7 +81,7 @@ class WiFiTCPFcfsSource:
             self.connected = False
             self.connect_to_destination()
 
-    def process_buffer(self):
+    def process_buffer(self, now):
         while True:
             if len(self.recv_buffer) < 4:
                 # Not enough data to read the length prefix
@@ -97,18 +96,16 @@ class WiFiTCPFcfsSource:
             self.recv_buffer = self.recv_buffer[4 + total_length:]
             # Process the message
             data_str = message_bytes[4:].decode()
-            self.process_time_response(data_str)
+            self.process_time_response(data_str, now)
 
-    def process_time_response(self, data_str):
+    def process_time_response(self, data_str, now):
         if data_str.startswith('TIME_RESPONSE'):
             parts = data_str.split(':')
             if len(parts) == 3:
-                dest_time = float(parts[1])
-                t1 = float(parts[2])
-                t2 = time.time()
-                offset = dest_time - ((t1 + t2) / 2)
-                self.clock_offset = self.clock_offset_alpha * offset + (1 - self.clock_offset_alpha) * self.clock_offset
-                print(f"Updated clock offset: {self.clock_offset} seconds")
+                dest_time = int(parts[1])
+                t1 = int(parts[2])
+                self.clock_sync.add_sample(t1, dest_time, now)
+                print(f"Updated clock offset: {self.clock_sync.offset(now)} ns")
             else:
                 print(f"Malformed TIME_RESPONSE message: {data_str}")
         else:
@@ -118,22 +115,20 @@ class WiFiTCPFcfsSource:
         packet.source_id = self.source_id  # Set the source_id
         self.sock.sendall(packet.to_bytes())
 
-    def clock_synchronization(self):
-        for _ in range(self.sync_rounds):
-            try:
-                current_time = time.time()
-                request = SensorData(
-                    is_fragmented=0,
-                    data_type=DataType.TIME_REQUEST,
-                    timestamp=current_time,
-                    source_id=self.source_id,
-                    data=b''
-                )
-                self.sock.sendall(request.to_bytes())
-            except BlockingIOError:
-                # print("BlockingIOError during clock synchronization")
-                pass
-        self.last_sync_time = time.time()
+    def clock_synchronization(self, current_time):
+        try:
+            request = SensorData(
+                is_fragmented=0,
+                data_type=DataType.TIME_REQUEST,
+                timestamp=current_time,
+                source_id=self.source_id,
+                data=b''
+            )
+            self.sock.sendall(request.to_bytes())
+        except BlockingIOError:
+            # print("BlockingIOError during clock synchronization")
+            pass
+        self.clock_sync.request_sent(current_time)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Start WiFiTCPFcfsSource')
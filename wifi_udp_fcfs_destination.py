@@ -7,15 +7,20 @@ import socket
 import time
 from typing import List, Tuple
 from sensor import DataType, SensorData
+from datagram_capture import DatagramRecorder, INBOUND, encode_streams
+from kernel_timestamps import enable_kernel_timestamps, recv_timestamped
 
 class SourceState:
-    def __init__(self, output_fd: TextIOWrapper = None):
+    # Times are integer nanoseconds of the destination's time.monotonic_ns(), source timestamps are mapped onto it
+    def __init__(self, output_fd: TextIOWrapper = None, now: int = None):
+        if now is None:
+            now = time.monotonic_ns()
         self.weight: float = 0
-        self.last_systime_received: float = time.time()
+        self.last_systime_received: int = now
         self.output_fd = output_fd
-        self.last_recorded_age = 0.0
-        self.total_weighted_ages: float = 0.0
-        self.last_received_time: float = time.time()
+        self.last_recorded_age = 0
+        self.total_weighted_ages: int = 0  # Integral of the age (ns^2)
+        self.last_received_time: int = now
 
 class WiFiUDPFcfsDestination:
     def __init__(
@@ -23,10 +28,18 @@ class WiFiUDPFcfsDestination:
         sources_addresses: List[Tuple[str, int, DataType]], 
         listen_port=9999, 
         age_record_dir='./ages_wifi_udp_fcfs',
-        age_record_interval=1e-4
+        age_record_interval=1e-4,
+        record_path=None,
+        kernel_timestamps=False,
+        clock=time.monotonic_ns,
+        sock: socket.socket = None
     ):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind(('0.0.0.0', listen_port))
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('0.0.0.0', listen_port))
+        self.sock = sock  # A replay passes in a socket that only collects what is sent
+        self.clock = clock  # Integer nanoseconds, a replay passes in its virtual clock
+        self.start_time = clock()
         self.sources_state: dict[Tuple[str, int, DataType], SourceState] = defaultdict(SourceState)
         self.age_record_dir = age_record_dir
         os.makedirs(age_record_dir, exist_ok=True)
@@ -34,80 +47,131 @@ class WiFiUDPFcfsDestination:
             # source_file_path = os.path.join(age_record_dir, f"{source_address[0]}_{source_address[1]}.txt")
             # with open(source_file_path, 'w'):
             #     pass
-            self.sources_state[source_address] = SourceState()
+            self.sources_state[source_address] = SourceState(now=self.start_time)
         self.age_record_interval = age_record_interval  # Age record interval
-        self.last_age_record_time = time.time() - self.age_record_interval
-        self.start_time = time.time()
+        self.last_age_record_time = self.start_time - int(self.age_record_interval * 1e9)
+        # Account updates at the kernel receive time (SO_TIMESTAMPNS), the user-space receive delay is measured separately
+        self.kernel_timestamps = kernel_timestamps
+        if kernel_timestamps:
+            enable_kernel_timestamps(self.sock)
+        self.datagrams_received = 0
+        self.receive_delay_total = 0  # User-space receive delay of all datagrams (ns)
+        self.receive_delay_max = 0
+        # Optional capture of every inbound datagram, with the configuration needed to replay it
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = DatagramRecorder(record_path, {
+                'destination': 'udp_fcfs',
+                'start_time': self.start_time,
+                'sources': encode_streams(sources_addresses),
+                'kwargs': {},
+            })
         self.running_period = 600.0  # 10 minutes in seconds
 
     def start(self):
         print("WiFi UDP FCFS destination started")
         self.sock.setblocking(False)
         while True:
-            self.receive_response()
-            # if time.time() - self.last_age_record_time >= self.age_record_interval:
-            #     self.record_age()
-            if time.time() - self.start_time >= self.running_period:
+            # One clock read per pass, integer nanoseconds of the monotonic clock
+            now = self.clock()
+            self.receive_response(now)
+            # if now - self.last_age_record_time >= self.age_record_interval * 1e9:
+            #     self.record_age(now)
+            if now - self.start_time >= self.running_period * 1e9:
                 self.save_ages()
+                if self.recorder is not None:
+                    self.recorder.close()
                 print("WiFi UDP FCFS destination stopped")
+                if self.kernel_timestamps and self.datagrams_received:
+                    print(f"User-space receive delay: mean {self.receive_delay_total / self.datagrams_received / 1e6:.3f} ms, "
+                          f"max {self.receive_delay_max / 1e6:.3f} ms over {self.datagrams_received} datagrams")
                 break
             
     def save_ages(self):
         record_file_path = os.path.join(self.age_record_dir, f"ages_{len(self.sources_state)}sources.txt")
+        now = self.clock()
         with open(record_file_path, 'w') as record_file:
             mean_ages = []
             for source_address, source in self.sources_state.items():
-                last_age_area =  (source.last_recorded_age + time.time() - source.last_systime_received) * (time.time() - source.last_received_time) / 2.0
+                last_age_area = (source.last_recorded_age + now - source.last_systime_received) * (now - source.last_received_time) // 2
                 source.total_weighted_ages += last_age_area
-                mean_age = source.total_weighted_ages / (time.time() - self.start_time)
+                mean_age = source.total_weighted_ages / (now - self.start_time) / 1e9
                 record_file.write(f"{source_address[0]}_{source_address[1]}_{source_address[2]}: {mean_age}\n")
                 mean_ages.append(mean_age)
             record_file.write(f"Mean AOI of all data sources: {sum(mean_ages) / len(mean_ages)}\n")
                     
-    def record_age(self):
+    def record_age(self, now):
         for source in self.sources_state.values():
-            current_time = time.time()
-            age = current_time - source.last_systime_received
-            age_area = (age + source.last_recorded_age) * (current_time - self.last_age_record_time) / 2
+            age = now - source.last_systime_received
+            age_area = (age + source.last_recorded_age) * (now - self.last_age_record_time) // 2
             source.total_weighted_ages += age_area
             source.last_recorded_age = age
-        self.last_age_record_time = time.time()
+        self.last_age_record_time = now
 
-    def receive_response(self):
+    def receive_response(self, now):
         readable, _, _ = select.select([self.sock], [], [], 0)
         if readable:
-            data_bytes, addr = self.sock.recvfrom(4096*4096)
-            print(f"Received data from {addr}, size {len(data_bytes)}")
-            data_structed = SensorData.from_bytes(data_bytes)
-            # print(f"Received data from {addr}: {data_structed}")
-            if data_structed.data_type == DataType.TIME_REQUEST:
-                source_time = data_structed.timestamp
-                # Handle time synchronization request
-                current_time = time.time()
-                response = f"TIME_RESPONSE:{current_time:010.15f}:{source_time:010.15f}"
-                try:
-                    self.sock.sendto(response.encode(), addr)
-                    print(f"Sent TIME_RESPONSE to {addr}: {current_time}")
-                except BlockingIOError:
-                    print("destination sendto BlockingIOError")
+            if self.kernel_timestamps:
+                data_bytes, addr, received_time = recv_timestamped(self.sock, 4096*4096)
+                if received_time is None:
+                    received_time = now
+                receive_delay = self.clock() - received_time
+                self.receive_delay_total += receive_delay
+                if receive_delay > self.receive_delay_max:
+                    self.receive_delay_max = receive_delay
+                # A datagram that arrived after this pass read the clock is accounted at the pass time
+                received_time = min(received_time, now)
             else:
-                # Assuming the type can be inferred from the data_structed
-                source_type = data_structed.data_type
-                addr_with_type = (addr[0], addr[1], source_type)
-                self.process_fragment(data_structed, addr_with_type)
+                data_bytes, addr = self.sock.recvfrom(4096*4096)
+                received_time = now
+                receive_delay = 0
+            self.datagrams_received += 1
+            print(f"Received data from {addr}, size {len(data_bytes)}")
+            if self.recorder is not None:
+                self.recorder.record(INBOUND, now, addr, data_bytes, now - received_time)
+            self.handle_datagram(data_bytes, addr, now, received_time)
+
+    def handle_datagram(self, data_bytes, addr, now, received_time=None):
+        # Everything done with a received datagram, a replay feeds the captured ones here.
+        # Updates are accounted at received_time, the kernel receive time if known
+        if received_time is None:
+            received_time = now
+        data_structed = SensorData.from_bytes(data_bytes)
+        # print(f"Received data from {addr}: {data_structed}")
+        if data_structed.data_type == DataType.TIME_REQUEST:
+            source_time = data_structed.timestamp
+            # Handle time synchronization request
+            response = f"TIME_RESPONSE:{now}:{source_time}"
+            try:
+                self.sock.sendto(response.encode(), addr)
+                print(f"Sent TIME_RESPONSE to {addr}: {now}")
+            except BlockingIOError:
+                print("destination sendto BlockingIOError")
+        elif data_structed.data_type == DataType.BATCH:
+            # Coalesced updates of several sensors, account every stream separately
+            for record in SensorData.unpack_batch(data_structed.data):
+                self.process_fragment(record, (addr[0], addr[1], record.data_type), received_time)
+        else:
+            # Assuming the type can be inferred from the data_structed
+            source_type = data_structed.data_type
+            addr_with_type = (addr[0], addr[1], source_type)
+            self.process_fragment(data_structed, addr_with_type, received_time)
             
 
-    def process_fragment(self, fresh_fragment: SensorData, source_addr):
+    def process_fragment(self, fresh_fragment: SensorData, source_addr, now):
         if fresh_fragment is None:
             return
+        if source_addr not in self.sources_state:
+            # Created on the caller's clock, which is virtual in a replay
+            self.sources_state[source_addr] = SourceState(now=now)
         source = self.sources_state[source_addr]
         # Update last_systime_received
-        fresh_fragment.timestamp = max(fresh_fragment.timestamp, time.time())
+        fresh_fragment.timestamp = max(fresh_fragment.timestamp, now)
         if source.last_systime_received < fresh_fragment.timestamp:
-            time_received = time.time()
+            time_received = now
             # Record age
             age = time_received - source.last_systime_received
-            age_area = (age + source.last_recorded_age) * (time_received - source.last_received_time) / 2
+            age_area = (age + source.last_recorded_age) * (time_received - source.last_received_time) // 2
             source.total_weighted_ages += age_area
             source.last_received_time = time_received
             source.last_recorded_age = time_received - fresh_fragment.timestamp
@@ -118,6 +182,8 @@ if __name__ == '__main__':
     parser.add_argument('--sources', nargs='+', help='List of source addresses in the format ip:port:type')
     parser.add_argument('--listen_port', type=int, default=9999, help='Port to listen on')
     parser.add_argument('--age_record_dir', default='./ages_wifresh_app', help='Directory to store age records')
+    parser.add_argument('--record_file', default=None, help='Capture every inbound datagram to this file, see datagram_replay.py')
+    parser.add_argument('--kernel_timestamps', action='store_true', help='Account updates at their SO_TIMESTAMPNS kernel receive time and report the user-space receive delay')
     args = parser.parse_args()
 
     sources_addresses = []
@@ -133,6 +199,8 @@ if __name__ == '__main__':
     destination = WiFiUDPFcfsDestination(
         sources_addresses=sources_addresses,
         listen_port=args.listen_port,
-        age_record_dir=args.age_record_dir
+        age_record_dir=args.age_record_dir,
+        record_path=args.record_file,
+        kernel_timestamps=args.kernel_timestamps
     )
     destination.start()
\ No newline at end of file
@@ -4,7 +4,8 @@ import select
 import socket
 import time
 from typing import List
-from sensor import Sensor, SensorData, DataType
+from sensor import Sensor, SensorData, DataType, TIMESTAMP_FIELD, TIMESTAMP_OFFSET, IP_UDP_HEADER_SIZE
+from clock_sync import ClockSynchronizer
 
 class WiFiUDPFcfsSource:
     def __init__(
@@ -12,47 +13,54 @@ class WiFiUDPFcfsSource:
         listen_port, 
         destination_address,
         sensor_list: List[Sensor],
-        sync_interval=5,
-        sync_rounds=5,
-        clock_offset_alpha=0.02
+        min_sync_interval=1.0,
+        max_sync_interval=64.0,
+        extra_destinations=(),
+        coalesce_delay=0.0,
+        mtu=1500
     ):
         self.listen_port = listen_port
-        self.destination_address = destination_address
+        self.destination_address = destination_address  # Primary destination
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind(('0.0.0.0', self.listen_port))
         self.sensor_list = sensor_list
-        self.clock_offset = 0.0  # Clock offset
-        self.sync_interval = sync_interval  # Clock synchronization interval (seconds)
-        self.last_sync_time = time.time()
-        self.sync_rounds = sync_rounds  # Number of messages per synchronization
-        self.clock_offset_alpha = clock_offset_alpha  # Smoothing factor for clock offset adjustment (0 < alpha <= 1)
+        # Clock offset/skew estimator per destination, sync interval adapts between the two bounds (seconds)
+        self.clock_syncs = {address: ClockSynchronizer(min_sync_interval, max_sync_interval) for address in [destination_address, *extra_destinations]}
+        # Optional coalescing: updates of all sensors ready within coalesce_delay seconds go out as one BATCH datagram
+        # of length-delimited records, at most one MTU. Updates too large to share a datagram are sent alone right away
+        self.coalesce_delay = int(coalesce_delay * 1e9)  # Max delay added to an update (ns), 0 sends every update on its own
+        self.max_batch_size = mtu - IP_UDP_HEADER_SIZE - SensorData.header_size  # Max payload of a BATCH datagram
+        self.batch: list[SensorData] = []
+        self.batch_budget = self.max_batch_size
+        self.batch_deadline = 0
 
     def start(self):
-        print(f"WiFi UDP FCFS source started on port {self.listen_port}")
+        print(f"WiFi UDP FCFS source started on port {self.listen_port}, {len(self.clock_syncs)} destinations")
         self.sock.setblocking(False)
         while True:
+            # One clock read per pass, integer nanoseconds of the monotonic clock
+            now = time.monotonic_ns()
             # Handle received messages
-            self.receive_response()
+            self.receive_response(now)
             # Check if clock synchronization is needed
-            if time.time() - self.last_sync_time >= self.sync_interval:
-                self.clock_synchronization()
-                self.last_sync_time = time.time()
+            for address, clock_sync in self.clock_syncs.items():
+                if clock_sync.due(now):
+                    self.clock_synchronization(address, clock_sync, now)
 
+            clock_offsets = [(address, clock_sync.offset(now)) for address, clock_sync in self.clock_syncs.items()]
             for sensor in self.sensor_list:
                 # Try generate sensor data
-                sensor.generate_data()
-                if sensor.complete_data_queue:
-                    # Adjust timestamp using clock offset
-                    oldest_data = sensor.complete_data_queue[0]
-                    oldest_data.timestamp += self.clock_offset
-                    try:
-                        self.send_packet(oldest_data)
+                sensor.generate_data(now)
+                if self.coalesce_delay:
+                    self.coalesce(sensor, clock_offsets, now)
+                elif sensor.complete_data_queue:
+                    # Kept for the next pass if no destination could take it
+                    if self.send_packet(sensor.complete_data_queue[0], clock_offsets):
                         sensor.complete_data_queue.pop(0)
-                    except BlockingIOError:
-                        print("source run send_packet BlockingIOError")
-                        oldest_data.timestamp -= self.clock_offset
+            if self.batch and now >= self.batch_deadline:
+                self.flush_batch(clock_offsets, now)
 
-    def receive_response(self):
+    def receive_response(self, now):
         readable, _, _ = select.select([self.sock], [], [], 0)
         if readable:
             data, addr = self.sock.recvfrom(1024)
@@ -61,40 +69,95 @@ class WiFiUDPFcfsSource:
                 # Handle clock synchronization response
                 parts = data_str.split(':')
                 if len(parts) == 3:
-                    dest_time = float(parts[1])
-                    t1 = float(parts[2])
-                    t2 = time.time()
-                    offset = dest_time - ((t1 + t2) / 2)
-                    # Update clock offset using exponential moving average
-                    self.clock_offset = self.clock_offset_alpha * offset + (1 - self.clock_offset_alpha) * self.clock_offset
-                    print(f"Updated clock offset: {self.clock_offset} seconds")
+                    dest_time = int(parts[1])
+                    t1 = int(parts[2])
+                    clock_sync = self.clock_syncs.get(addr)
+                    if clock_sync is None and len(self.clock_syncs) == 1:
+                        clock_sync = self.clock_syncs[self.destination_address]  # A single destination may answer from another of its addresses
+                    if clock_sync is None:
+                        print(f"Received TIME_RESPONSE from unknown destination {addr}")
+                        return
+                    # Keep the lowest-RTT samples and refit offset and skew
+                    clock_sync.add_sample(t1, dest_time, now)
+                    print(f"Updated clock offset of {addr}: {clock_sync.offset(now)} ns, next sync in {clock_sync.sync_interval / 1e9} seconds")
             else:
                 print(f"Received unknown message from {addr}: {data_str}")
 
-    def send_packet(self, packet: SensorData):
-        bytes_sent = self.sock.sendto(packet.to_bytes(), self.destination_address)
-        # print(f"Sent {bytes_sent} bytes to {self.destination_address}")
+    def coalesce(self, sensor: Sensor, clock_offsets, now):
+        while sensor.complete_data_queue:
+            update = sensor.complete_data_queue[0]
+            record_size = SensorData.batch_record_size(len(update.data))
+            if record_size > self.max_batch_size:
+                if not self.send_packet(update, clock_offsets):
+                    return
+            else:
+                if record_size > self.batch_budget and not self.flush_batch(clock_offsets, now):
+                    return
+                if not self.batch:
+                    self.batch_deadline = now + self.coalesce_delay
+                self.batch.append(update)
+                self.batch_budget -= record_size
+            sensor.complete_data_queue.pop(0)
+
+    def flush_batch(self, clock_offsets, now):
+        # Return whether the batch went out, it is kept for the next pass otherwise
+        if len(self.batch) == 1:
+            sent = self.send_packet(self.batch[0], clock_offsets)
+        else:
+            datagram = bytearray(SensorData.pack_batch(self.batch, now).to_bytes())
+            # Timestamp fields of the BATCH header and of every record header, rewritten per destination
+            timestamps = [(TIMESTAMP_OFFSET, now)]
+            offset = SensorData.header_size
+            for record in self.batch:
+                timestamps.append((offset + 2 + TIMESTAMP_OFFSET, record.timestamp))
+                offset += SensorData.batch_record_size(len(record.data))
+            sent = self.send_datagram(datagram, timestamps, clock_offsets)
+        if sent:
+            self.batch = []
+            self.batch_budget = self.max_batch_size
+        return sent
 
-    def clock_synchronization(self):
-        for _ in range(self.sync_rounds):
-            # Send TIME_REQUEST to the destination
+    def send_packet(self, packet: SensorData, clock_offsets):
+        return self.send_datagram(bytearray(packet.to_bytes()), [(TIMESTAMP_OFFSET, packet.timestamp)], clock_offsets)
+
+    def send_datagram(self, datagram: bytearray, timestamps, clock_offsets):
+        # Serialized once, each destination only rewrites the (offset, source time) timestamp fields with its own clock offset.
+        # Return whether at least one destination took the datagram
+        sent = False
+        for address, clock_offset in clock_offsets:
+            for offset, timestamp in timestamps:
+                TIMESTAMP_FIELD.pack_into(datagram, offset, timestamp + clock_offset)
             try:
-                current_time = time.time()
-                request = SensorData(is_fragmented=0, data_type=DataType.TIME_REQUEST, timestamp=current_time, data=b'')
-                self.sock.sendto(request.to_bytes(), self.destination_address)
+                bytes_sent = self.sock.sendto(datagram, address)
+                # print(f"Sent {bytes_sent} bytes to {address}")
+                sent = True
             except BlockingIOError:
-                print("source clock_synchronization sendto BlockingIOError")
+                print(f"source send_packet to {address} BlockingIOError")
+        return sent
+
+    def clock_synchronization(self, address, clock_sync: ClockSynchronizer, current_time):
+        # Send a single TIME_REQUEST to the destination, the filter only needs one sample per interval
+        try:
+            request = SensorData(is_fragmented=0, data_type=DataType.TIME_REQUEST, timestamp=current_time, data=b'')
+            self.sock.sendto(request.to_bytes(), address)
+        except BlockingIOError:
+            print("source clock_synchronization sendto BlockingIOError")
+        clock_sync.request_sent(current_time)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Start WiFi UDP FCFS Source')
     parser.add_argument('--listen_port', type=int, required=True, help='Port to listen on')
-    parser.add_argument('--destination', required=True, help='Destination address in the format ip:port')
+    parser.add_argument('--destination', nargs='+', required=True, help='Destination addresses in the format ip:port, the first is the primary')
     parser.add_argument('--sensors', nargs='+', required=True, help='Sensor configurations in the format type:size:frequency')
+    parser.add_argument('--coalesce_delay', type=float, default=0.0, help='Pack updates ready within this many seconds into one BATCH datagram, 0 disables coalescing')
+    parser.add_argument('--mtu', type=int, default=1500, help='Link MTU bounding a coalesced datagram')
     args = parser.parse_args()
     
 
-    dest_ip, dest_port = args.destination.split(':')
-    destination_address = (dest_ip, int(dest_port))
+    destination_addresses = []
+    for destination_arg in args.destination:
+        dest_ip, dest_port = destination_arg.split(':')
+        destination_addresses.append((dest_ip, int(dest_port)))
 
     # Parse sensor configurations
     sensor_list = []
@@ -108,7 +171,10 @@ if __name__ == '__main__':
 
     source = WiFiUDPFcfsSource(
         listen_port=args.listen_port,
-        destination_address=destination_address,
-        sensor_list=sensor_list
+        destination_address=destination_addresses[0],
+        sensor_list=sensor_list,
+        extra_destinations=destination_addresses[1:],
+        coalesce_delay=args.coalesce_delay,
+        mtu=args.mtu
     )
     source.start()
\ No newline at end of file
@@ -0,0 +1,658 @@
+import argparse
+from io import TextIOWrapper
+import json
+import os
+import select
+import socket
+import stat
+import time
+from typing import List, Tuple
+from collections import OrderedDict, defaultdict
+from sensor import SensorData, DataType, MAX_STREAM_ID, IP_UDP_HEADER_SIZE
+from rtt_estimator import RTTEstimator
+from reassembly import ReassemblyCache
+from scheduling_policy import POLICIES, normalize_stream, stream_label
+from source_state_table import SourceStateTable, VECTORIZED_POLICIES
+from update_trace import UpdateTracer, RECEIVED, ACCEPTED
+from datagram_capture import DatagramRecorder, INBOUND, OUTBOUND, encode_streams
+from kernel_timestamps import enable_kernel_timestamps, recv_timestamped
+from payload_codec import decode_payload
+from delta_encoding import DeltaDecoder, NONE
+
+# A multi-stream POLL grants no more streams than fit in one datagram of a 1500-byte MTU
+MAX_POLL_SIZE = 1500 - IP_UDP_HEADER_SIZE
+# A query client that has not read its whole reply by then is disconnected (ns)
+QUERY_REPLY_TIMEOUT = 1_000_000_000
+
+class SourceState:
+    # Times are integer nanoseconds of the destination's time.monotonic_ns(), source timestamps are mapped onto it
+    def __init__(self, output_fd: TextIOWrapper = None, now: int = None, stream=None):
+        if now is None:
+            now = time.monotonic_ns()
+        self.stream = stream  # (ip, port, type value, stream id) this state belongs to
+        self.last_systime_received: int = now
+        self.update_fragments: int = 1  # Number of datagrams the last complete update needed
+        self.fragmented: bool = False  # Whether the last complete update needed more than one datagram
+        self.backlog: int = 0  # Remaining fragments the source advertised in its last response
+        self.output_fd = output_fd
+        self.last_recorded_age = 0
+        self.total_weighted_ages: int = 0  # Integral of the age (ns^2)
+        self.last_received_time: int = now
+        self.peak_age: int = 0  # Largest age reached right before an update
+        self.polls: int = 0  # Polls granting the stream
+        self.delivered: int = 0  # Updates accounted in the age
+        self.next_update_time: int = 0  # Next update time advertised by the source, 0 if unknown
+        self.last_poll_time: int = now  # Time of the last poll granting the stream
+
+class PendingPoll:
+    def __init__(self, source_tuple, sent_time: int, deadline: int, burst=False, retransmitted=False):
+        self.source_tuple = source_tuple  # Selected stream of the outstanding poll
+        self.sent_time = sent_time
+        self.deadline = deadline  # The poll counts as failed if no response arrives by then
+        self.burst = burst  # Burst grant, the poll stays outstanding until the last fragment arrives
+        # Sent after a timed-out poll of the same source: a response may answer either, so it is no RTT sample (Karn's rule)
+        self.retransmitted = retransmitted
+        self.first_response_time: int = None
+
+class WiFreshDestination:
+    def __init__(
+        self, 
+        sources_addresses: List[Tuple[str, int, DataType, int]], 
+        listen_port=9999, 
+        age_record_dir='./ages_wifresh_app',
+        policy='app',
+        policy_kwargs=None,
+        poll_interval=0.3,
+        age_record_interval=1e-4,
+        multi_stream_poll=False,
+        poll_window=1,
+        burst_grants=False,
+        reassembly_entries=64,
+        reassembly_timeout=0.5,
+        state_backend='objects',
+        max_dynamic_streams=0,
+        dynamic_stream_timeout=10.0,
+        trace_path=None,
+        trace_sample=0.01,
+        query_socket_path=None,
+        record_path=None,
+        kernel_timestamps=False,
+        liveness_interval=1.0,
+        clock=time.monotonic_ns,
+        sock: socket.socket = None
+    ):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('0.0.0.0', listen_port))
+        self.sock = sock  # A shard of a sharded destination passes in its pre-bound SO_REUSEPORT socket
+        self.poll_interval = poll_interval  # Poll timeout until the first RTT sample of a source
+        self.age_record_interval = age_record_interval  # Age record interval
+        self.clock = clock  # Integer nanoseconds, a replay passes in its virtual clock
+        self.start_time = clock()
+        self.age_record_dir = age_record_dir
+        os.makedirs(age_record_dir, exist_ok=True)
+        sources_addresses = [normalize_stream(source_address) for source_address in sources_addresses]
+        self.state_backend = state_backend  # 'objects': one SourceState per stream, 'numpy': one array per attribute
+        if state_backend == 'numpy':
+            if policy not in VECTORIZED_POLICIES:
+                raise ValueError(f"The {policy} policy is not available with the numpy state backend")
+            self.sources_state = SourceStateTable(sources_addresses, self.start_time)
+            policies = VECTORIZED_POLICIES
+        else:
+            self.sources_state: dict[Tuple[str, int, int, int], SourceState] = {}
+            for source_address in sources_addresses:
+                # source_file_path = os.path.join(age_record_dir, f"{source_address[0]}_{source_address[1]}_{source_address[2]}.txt")
+                # with open(source_file_path, 'w'):
+                #     # Open file in write mode to clear contents
+                #     pass
+                self.sources_state[source_address] = SourceState(now=self.start_time, stream=source_address)
+            policies = POLICIES
+        # Decides the next stream to poll, notified of every poll, update and timeout
+        self.policy = policies[policy](self.sources_state, **(policy_kwargs or {}))
+        # Streams whose source advertised its next update for later are not polled until then, except for a liveness probe
+        self.policy.liveness_interval = int(liveness_interval * 1e9)
+        self.multi_stream_poll = multi_stream_poll  # Grant all small streams of a source in a single POLL
+        self.streams_by_source: dict[Tuple[str, int], List[Tuple[str, int, int, int]]] = defaultdict(list)
+        # Per source address, its streams indexed by stream id: a response is dispatched to its stream with one
+        # array lookup instead of building a stream tuple per record
+        self.stream_slots: dict[Tuple[str, int], list] = {}
+        for source_address in sources_addresses:
+            self.register_stream(source_address)
+        self.rtt_estimators: dict[Tuple[str, int], RTTEstimator] = {
+            source_address: RTTEstimator(initial_timeout=poll_interval) for source_address in self.streams_by_source
+        }
+        self.burst_grants = burst_grants  # Let a source send all remaining fragments of an update on one poll
+        self.poll_window = poll_window  # Max number of outstanding polls, each to a distinct source
+        self.pending_polls: dict[Tuple[str, int], PendingPoll] = {}  # Outstanding polls by source address
+        # Partial updates of all streams, bounded in number and age so memory stays bounded under loss
+        self.reassembly = ReassemblyCache(max_entries=reassembly_entries, timeout=reassembly_timeout)
+        # Admission of streams the destination was not configured with: none by default, datagrams of unknown
+        # senders are dropped before parsing. Otherwise at most max_dynamic_streams of them, least recently heard first
+        # evicted when a new one arrives or once silent for dynamic_stream_timeout. Configured streams are never evicted
+        self.max_dynamic_streams = max_dynamic_streams
+        self.dynamic_stream_timeout = int(dynamic_stream_timeout * 1e9)  # Nanoseconds, constructor takes seconds
+        self.dynamic_streams: OrderedDict = OrderedDict()  # Admitted unknown stream -> last reception time, LRU first
+        self.rejected_datagrams = 0
+        self.evicted_streams = 0
+        # Optional sampled per-update latency stamps, the sources trace the same updates
+        self.tracer = UpdateTracer(trace_path, sample_fraction=trace_sample) if trace_path is not None else None
+        # Optional Unix-domain socket: every connection gets the current per-stream AoI as JSON, served from the
+        # poll loop and computed only when a client connects
+        self.query_socket_path = query_socket_path
+        self.query_sock = None
+        if query_socket_path is not None:
+            try:
+                # Only a socket left over by a previous run is replaced, never another file at a mistyped path
+                if not stat.S_ISSOCK(os.lstat(query_socket_path).st_mode):
+                    raise FileExistsError(f"Query socket path {query_socket_path} exists and is not a socket")
+                os.unlink(query_socket_path)
+            except FileNotFoundError:
+                pass
+            self.query_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.query_sock.bind(query_socket_path)
+            self.query_sock.listen(8)
+            self.query_sock.setblocking(False)
+        self.select_socks = [self.sock] if self.query_sock is None else [self.sock, self.query_sock]
+        # Query connection -> [unsent part of its reply, deadline], drained when select reports it writable
+        self.query_replies = {}
+        # Optional capture of every inbound datagram and outbound poll, with the configuration needed to replay it
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = DatagramRecorder(record_path, {
+                'destination': 'wifresh',
+                'start_time': self.start_time,
+                'sources': encode_streams(sources_addresses),
+                'kwargs': {
+                    'policy': policy,
+                    'policy_kwargs': {
+                        name: [[key.name if isinstance(key, DataType) else encode_streams([key])[0], value] for key, value in arg.items()] if name == 'weights' else arg
+                        for name, arg in (policy_kwargs or {}).items()
+                    },
+                    'poll_interval': poll_interval,
+                    'multi_stream_poll': multi_stream_poll,
+                    'poll_window': poll_window,
+                    'burst_grants': burst_grants,
+                    'reassembly_entries': reassembly_entries,
+                    'reassembly_timeout': reassembly_timeout,
+                    'state_backend': state_backend,
+                    'max_dynamic_streams': max_dynamic_streams,
+                    'dynamic_stream_timeout': dynamic_stream_timeout,
+                    'liveness_interval': liveness_interval,
+                },
+            })
+        # Account updates at the kernel receive time (SO_TIMESTAMPNS) instead of the loop pass that reads them,
+        # the time datagrams wait in the socket queue and in this loop is measured separately
+        self.kernel_timestamps = kernel_timestamps
+        if kernel_timestamps:
+            enable_kernel_timestamps(self.sock)
+        self.decode_errors = 0  # Updates whose payload codec could not be undone
+        # Reference update per delta-encoded stream, a delta against a missing reference asks for a keyframe in the next poll
+        self.delta_decoder = DeltaDecoder()
+        self.keyframe_requests = set()
+        self.missed_deltas = 0
+        self.empty_responses = 0  # Response datagrams without any update, polls the source could not use
+        self.datagrams_received = 0
+        self.receive_delay_total = 0  # User-space receive delay of all datagrams (ns)
+        self.receive_delay_max = 0
+        self.polls_sent = 0
+        self.poll_timeouts = 0
+        self.last_age_record_time = self.start_time - int(self.age_record_interval * 1e9)
+        self.running_period = 600.0  # 10 minutes in seconds
+
+    def start(self):
+        print(f"WiFresh {self.policy.label} destination started")
+        self.sock.setblocking(False)
+        while True:
+            # One clock read per pass, integer nanoseconds of the monotonic clock
+            now = self.clock()
+            self.receive_response(now)
+            self.advance(now)
+            # if now - self.last_age_record_time >= self.age_record_interval * 1e9:
+            #     self.record_age(now)
+            if now - self.start_time >= self.running_period * 1e9:
+                self.save_ages()
+                if self.tracer is not None:
+                    self.tracer.close()
+                if self.query_sock is not None:
+                    for conn in self.query_replies:
+                        conn.close()
+                    self.query_sock.close()
+                    os.unlink(self.query_socket_path)
+                if self.recorder is not None:
+                    self.recorder.close()
+                print(f"WiFresh {self.policy.label} destination stopped, {self.poll_timeouts} polls timed out, "
+                      f"incomplete updates dropped: {self.reassembly.superseded} superseded, {self.reassembly.expired} expired, {self.reassembly.evicted} evicted, "
+                      f"{self.rejected_datagrams} datagrams of unknown senders rejected, {self.evicted_streams} unknown streams evicted, "
+                      f"{self.decode_errors} updates failed to decode, {self.missed_deltas} deltas without reference, "
+                      f"{self.empty_responses} empty responses to {self.polls_sent} polls")
+                if self.kernel_timestamps and self.datagrams_received:
+                    print(f"User-space receive delay: mean {self.receive_delay_total / self.datagrams_received / 1e6:.3f} ms, "
+                          f"max {self.receive_delay_max / 1e6:.3f} ms over {self.datagrams_received} datagrams")
+                break
+
+    def advance(self, now):
+        # Rest of a loop pass after reception: poll timeouts, reassembly and admission expiry, new polls
+        self.expire_polls(now)
+        self.reassembly.expire(now)
+        self.expire_dynamic_streams(now)
+        if self.query_replies:
+            self.expire_query_replies(now)
+        if len(self.pending_polls) < self.poll_window:
+            self.schedule_poll(now)
+
+    def save_ages(self):
+        record_file_path = os.path.join(self.age_record_dir, f"ages_{len(self.sources_state)}sources.txt")
+        with open(record_file_path, 'w') as record_file:
+            mean_ages = self.mean_ages()
+            for source_label, mean_age in mean_ages.items():
+                record_file.write(f"{source_label}: {mean_age}\n")
+            record_file.write(f"Mean AOI of all data sources: {sum(mean_ages.values()) / len(mean_ages)}\n")
+
+    def mean_ages(self):
+        # Close the age integral of every stream at the current time, mean ages in seconds
+        now = self.clock()
+        if self.state_backend == 'numpy':
+            return self.sources_state.mean_ages(now, self.start_time)
+        mean_ages = {}
+        for source_address, source in self.sources_state.items():
+            last_age_area = (source.last_recorded_age + now - source.last_systime_received) * (now - source.last_received_time) // 2
+            source.total_weighted_ages += last_age_area
+            mean_ages[stream_label(source_address)] = source.total_weighted_ages / (now - self.start_time) / 1e9
+        return mean_ages
+    
+    def live_ages(self, now):
+        # Snapshot of every stream at now, ages in seconds. The open age area since the last update is added
+        # on the fly, the accumulated integrals are left untouched
+        streams = {}
+        for stream, source in self.sources_state.items():
+            age = now - source.last_systime_received
+            age_area = source.total_weighted_ages + (source.last_recorded_age + age) * (now - source.last_received_time) // 2
+            streams[stream_label(stream)] = {
+                'age': age / 1e9,
+                'mean_aoi': age_area / max(now - self.start_time, 1) / 1e9,
+                'peak_aoi': max(source.peak_age, age) / 1e9,
+                'polls': source.polls,
+                'delivery_ratio': source.delivered / source.polls if source.polls else None,
+            }
+        return {
+            'policy': self.policy.name,
+            'uptime': (now - self.start_time) / 1e9,
+            'polls_sent': self.polls_sent,
+            'poll_timeouts': self.poll_timeouts,
+            'rejected_datagrams': self.rejected_datagrams,
+            'evicted_streams': self.evicted_streams,
+            'receive_delay_mean': self.receive_delay_total / self.datagrams_received / 1e9 if self.kernel_timestamps and self.datagrams_received else None,
+            'receive_delay_max': self.receive_delay_max / 1e9 if self.kernel_timestamps else None,
+            'streams': streams,
+        }
+
+    def serve_query(self, now):
+        try:
+            conn, _ = self.query_sock.accept()
+        except BlockingIOError:
+            return
+        # The reply is queued and sent as far as the socket buffer takes it, the poll loop never waits for the client
+        conn.setblocking(False)
+        self.query_replies[conn] = [memoryview(json.dumps(self.live_ages(now)).encode() + b'\n'), now + QUERY_REPLY_TIMEOUT]
+        self.send_query_reply(conn)
+
+    def send_query_reply(self, conn):
+        reply = self.query_replies[conn]
+        try:
+            reply[0] = reply[0][conn.send(reply[0]):]
+        except BlockingIOError:
+            return
+        except OSError:
+            reply[0] = reply[0][:0]
+        if not reply[0]:
+            del self.query_replies[conn]
+            conn.close()
+
+    def expire_query_replies(self, now):
+        for conn in [conn for conn, (_, deadline) in self.query_replies.items() if now >= deadline]:
+            del self.query_replies[conn]
+            conn.close()
+
+    def record_age(self, now):
+        for source in self.sources_state.values():
+            age = now - source.last_systime_received
+            age_area = (age + source.last_recorded_age) * (now - self.last_age_record_time) // 2
+            source.total_weighted_ages += age_area
+            source.last_recorded_age = age
+        self.last_age_record_time = now
+
+    def schedule_poll(self, now):
+        # Fill the window of outstanding polls, never polling a source that already has one
+        while len(self.pending_polls) < self.poll_window:
+            source_to_poll = self.select_source(now)
+            if not source_to_poll:
+                break
+            self.send_poll(source_to_poll, now)
+
+    def select_source(self, now):
+        return self.policy.select_source(now, self.pending_polls)
+
+    def send_poll(self, source_tuple, now):
+        ip, port = source_tuple[:2]
+        state = self.sources_state[source_tuple]
+        burst = self.burst_grants and (state.backlog > 0 or state.fragmented)
+        granted_streams = [source_tuple] if burst else self.granted_streams(source_tuple, now)
+        if self.keyframe_requests:
+            # A 'k' suffix asks the source for a full keyframe of that stream
+            stream_ids = ','.join(f"{stream[3]}k" if stream in self.keyframe_requests else str(stream[3]) for stream in granted_streams)
+            self.keyframe_requests.difference_update(granted_streams)
+        else:
+            stream_ids = ','.join(str(stream[3]) for stream in granted_streams)
+        poll = f"{'BURST' if burst else 'POLL'}:{stream_ids}".encode()
+        self.sock.sendto(poll, (ip, port))
+        if self.recorder is not None:
+            self.recorder.record(OUTBOUND, now, (ip, port), poll)
+        # print(f"Sent POLL to {granted_streams}")
+        self.polls_sent += 1
+        rtt_estimator = self.rtt_estimators[source_tuple[:2]]
+        self.pending_polls[source_tuple[:2]] = PendingPoll(
+            source_tuple, now, now + int(rtt_estimator.poll_timeout * 1e9), burst, retransmitted=rtt_estimator.timed_out
+        )
+        rtt_estimator.timed_out = False
+        for stream in granted_streams:
+            state = self.sources_state[stream]
+            state.polls += 1
+            state.last_poll_time = now
+            self.policy.on_poll_sent(stream, now)
+
+    def expire_polls(self, now):
+        # Lost POLL or response: it already counts as a poll without a received update,
+        # back off the timeout of that source and free its slot so the next poll goes out right away
+        expired = [address for address, poll in self.pending_polls.items() if now >= poll.deadline]
+        for address in expired:
+            self.rtt_estimators[address].backoff()
+            self.policy.on_poll_timeout(self.pending_polls.pop(address).source_tuple, now)
+            self.poll_timeouts += 1
+
+    def answer_poll(self, addr, backlog, now):
+        # Match a response against the outstanding poll of its source, late responses are not RTT samples
+        pending_poll = self.pending_polls.get(addr[:2])
+        if pending_poll is None:
+            return False
+        rtt_estimator = self.rtt_estimators[addr[:2]]
+        if pending_poll.first_response_time is None:
+            pending_poll.first_response_time = now
+            if not pending_poll.retransmitted:
+                rtt_estimator.add_sample((now - pending_poll.sent_time) / 1e9)
+        if pending_poll.burst and backlog > 0:
+            # More fragments of the burst are on their way
+            pending_poll.deadline = now + int(rtt_estimator.poll_timeout * 1e9)
+            return False
+        del self.pending_polls[addr[:2]]
+        return True
+
+    def granted_streams(self, source_tuple, now):
+        # The selected stream comes first, the source answers it alone if it does not fit in one datagram.
+        # The other small streams follow by stream id, as many as fit in MAX_POLL_SIZE, except the ones
+        # the policy holds back until their advertised next update
+        state = self.sources_state[source_tuple]
+        if not self.multi_stream_poll or state.fragmented or state.backlog > 0:
+            return [source_tuple]
+        granted_streams = [source_tuple]
+        poll_size = len('POLL:') + len(str(source_tuple[3])) + 1
+        for other in self.stream_slots[source_tuple[:2]]:
+            if other is None or other[3] == source_tuple[3]:
+                continue
+            other_state = self.sources_state[other]
+            if other_state.fragmented or other_state.backlog > 0 or self.policy.suppressed(other, now):
+                continue
+            poll_size += len(str(other[3])) + 2  # Comma, stream id and a possible 'k' suffix
+            if poll_size > MAX_POLL_SIZE:
+                break
+            granted_streams.append(other)
+        return granted_streams
+
+    def receive_response(self, now):
+        readable, writable, _ = select.select(self.select_socks, list(self.query_replies), [], 0)
+        for conn in writable:
+            self.send_query_reply(conn)
+        if self.query_sock is not None and self.query_sock in readable:
+            self.serve_query(now)
+        if self.sock in readable:
+            if self.kernel_timestamps:
+                data_bytes, addr, received_time = recv_timestamped(self.sock, 4096*4096)
+                if received_time is None:
+                    received_time = now
+                receive_delay = self.clock() - received_time
+                self.receive_delay_total += receive_delay
+                if receive_delay > self.receive_delay_max:
+                    self.receive_delay_max = receive_delay
+                # A datagram that arrived after this pass read the clock is accounted at the pass time
+                received_time = min(received_time, now)
+            else:
+                data_bytes, addr = self.sock.recvfrom(4096*4096)
+                received_time = now
+                receive_delay = 0
+            self.datagrams_received += 1
+            if self.recorder is not None:
+                self.recorder.record(INBOUND, now, addr, data_bytes, now - received_time)
+            self.handle_datagram(data_bytes, addr, now, received_time)
+
+    def handle_datagram(self, data_bytes, addr, now, received_time=None):
+        # Everything done with a received datagram, a replay feeds the captured ones here. Updates are accounted at
+        # received_time, the kernel receive time if known. Polls are matched at now, as their deadlines are enforced by this loop
+        if received_time is None:
+            received_time = now
+        if not self.max_dynamic_streams and addr[:2] not in self.stream_slots:
+            self.rejected_datagrams += 1
+            return
+        # if addr not in self.sources_state:
+        #     print(f"Received data from unknown source {addr}: {data_bytes.decode()}")
+        #     exit(1)
+        try:
+            data_structed = SensorData.from_bytes(data_bytes)
+            # A malformed batch is rejected as a whole, before any of its records is accounted
+            records = SensorData.unpack_batch(data_structed.data) if data_structed.data_type == DataType.BATCH else None
+        except ValueError:
+            self.rejected_datagrams += 1
+            return
+        # print(f"Received data from {addr}: {data_structed}")
+        if data_structed.data_type == DataType.TIME_REQUEST:
+            source_time = data_structed.timestamp
+            # Handle time synchronization request
+            response = f"TIME_RESPONSE:{now}:{source_time}"
+            self.sock.sendto(response.encode(), addr)
+            # print(f"Sent TIME_RESPONSE to {addr}: {now}")
+        else:
+            # Every response datagram, complete update or fragment, answers the outstanding poll,
+            # except the fragments of a burst before the last one
+            answered = self.answer_poll(addr, data_structed.backlog, now)
+            # Sources number updates from 1, an empty record carries 0. A datagram counts once, however many records it has
+            if records is not None:
+                # Coalesced response to a multi-stream POLL, account every stream separately
+                if all(record.update_id == 0 for record in records):
+                    self.empty_responses += 1
+                for record in records:
+                    self.process_fragment(record, self.state_of(addr, record, now), received_time, answered)
+            else:
+                if data_structed.update_id == 0:
+                    self.empty_responses += 1
+                self.process_fragment(data_structed, self.state_of(addr, data_structed, now), received_time, answered)
+            # Schedule the next poll
+            if answered:
+                self.schedule_poll(now)
+
+    def register_stream(self, stream):
+        ip, port, _, stream_id = stream
+        if not 0 <= stream_id <= MAX_STREAM_ID:
+            raise ValueError(f"Invalid stream id {stream_id} of {stream}")
+        slots = self.stream_slots.setdefault((ip, port), [])
+        if stream_id >= len(slots):
+            slots.extend([None] * (stream_id + 1 - len(slots)))
+        slots[stream_id] = stream
+        self.streams_by_source[(ip, port)].append(stream)
+
+    def state_of(self, addr, record: SensorData, now):
+        # State of the stream of a received record, None if the record is rejected
+        slots = self.stream_slots.get(addr[:2])
+        if slots is not None and record.stream_id < len(slots) and slots[record.stream_id] is not None:
+            stream = slots[record.stream_id]
+            if self.dynamic_streams and stream in self.dynamic_streams:
+                self.dynamic_streams[stream] = now
+                self.dynamic_streams.move_to_end(stream)
+            return self.sources_state[stream]
+        # A stream the destination was not configured with
+        if not self.max_dynamic_streams:
+            self.rejected_datagrams += 1
+            return None
+        if len(self.dynamic_streams) >= self.max_dynamic_streams:
+            self.evict_stream(next(iter(self.dynamic_streams)))
+        stream = (addr[0], addr[1], record.data_type.value, record.stream_id)
+        if self.state_backend == 'numpy':
+            self.sources_state.add(stream, now)
+        else:
+            self.sources_state[stream] = SourceState(now=now, stream=stream)
+        self.register_stream(stream)
+        self.rtt_estimators.setdefault(addr[:2], RTTEstimator(initial_timeout=self.poll_interval))
+        self.policy.add_stream(stream)
+        self.dynamic_streams[stream] = now
+        return self.sources_state[stream]
+
+    def expire_dynamic_streams(self, now):
+        # Streams are in LRU order, so only the oldest ones need to be checked
+        while self.dynamic_streams:
+            stream, last_seen = next(iter(self.dynamic_streams.items()))
+            if now - last_seen < self.dynamic_stream_timeout:
+                break
+            self.evict_stream(stream)
+
+    def evict_stream(self, stream):
+        del self.dynamic_streams[stream]
+        address = stream[:2]
+        self.policy.remove_stream(stream)
+        if self.state_backend == 'numpy':
+            self.sources_state.remove(stream)
+        else:
+            del self.sources_state[stream]
+        self.reassembly.forget(stream)
+        self.delta_decoder.forget(stream)
+        self.keyframe_requests.discard(stream)
+        self.stream_slots[address][stream[3]] = None
+        self.streams_by_source[address].remove(stream)
+        pending_poll = self.pending_polls.get(address)
+        if pending_poll is not None and pending_poll.source_tuple == stream:
+            del self.pending_polls[address]
+        if not self.streams_by_source[address]:
+            del self.stream_slots[address], self.streams_by_source[address]
+            self.pending_polls.pop(address, None)
+            self.rtt_estimators.pop(address, None)
+        self.evicted_streams += 1
+
+    def process_fragment(self, fresh_fragment: SensorData, source, now, answered=True):
+        if fresh_fragment is None or source is None:
+            return
+        source_addr = source.stream
+        source.backlog = fresh_fragment.backlog
+        if fresh_fragment.next_update is not None:
+            # Next update time advertised by the source, relative to the timestamp of this response
+            source.next_update_time = fresh_fragment.timestamp + fresh_fragment.next_update * 1000
+        complete_message = self.reassembly.add(source_addr, fresh_fragment, now)
+        if complete_message is not None:
+            source.update_fragments = fresh_fragment.frag_count
+            source.fragmented = fresh_fragment.frag_count > 1
+            traced = self.tracer is not None and self.tracer.sampled(fresh_fragment.update_id)
+            if traced:
+                self.tracer.stamp(RECEIVED, source_addr[0], source_addr[1], source_addr[3], fresh_fragment.update_id, now)
+            fresh_fragment.timestamp = max(fresh_fragment.timestamp, now)
+            if source.last_systime_received < fresh_fragment.timestamp:
+                if fresh_fragment.codec:
+                    # Undo the payload codec of the source, only for updates that are fresh. A corrupt one is not accounted
+                    try:
+                        complete_message = decode_payload(fresh_fragment.codec, complete_message)
+                    except ValueError:
+                        self.decode_errors += 1
+                        return
+                if fresh_fragment.delta != NONE:
+                    complete_message = self.delta_decoder.decode(source_addr, fresh_fragment.delta, fresh_fragment.update_id, complete_message)
+                    if complete_message is None:
+                        # The reference of this delta was lost, the update cannot be rebuilt and is not accounted
+                        self.missed_deltas += 1
+                        self.keyframe_requests.add(source_addr)
+                        return
+                time_received = now
+                # Record age
+                age = time_received - source.last_systime_received
+                if age > source.peak_age:
+                    source.peak_age = age
+                source.delivered += 1
+                age_area = (age + source.last_recorded_age) * (time_received - source.last_received_time) // 2
+                source.total_weighted_ages += age_area
+                source.last_received_time = time_received
+                source.last_recorded_age = time_received - fresh_fragment.timestamp
+                source.last_systime_received = fresh_fragment.timestamp
+                self.policy.on_update_received(source_addr, time_received, answered)
+                if traced:
+                    self.tracer.stamp(ACCEPTED, source_addr[0], source_addr[1], source_addr[3], fresh_fragment.update_id, self.clock())
+
+def main(default_policy='app'):
+    parser = argparse.ArgumentParser(description='Start WiFreshDestination')
+    parser.add_argument('--sources', nargs='+', help='List of source streams in the format ip:port:type[:stream_id], the stream id defaults to the type value')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default=default_policy, help='Scheduling policy deciding the next stream to poll')
+    parser.add_argument('--stream_weights', nargs='+', help='Weights of the whittle policy in the format ip:port:type[:stream_id]:weight per stream or type:weight per data type, 1 for unlisted streams')
+    parser.add_argument('--listen_port', type=int, default=9999, help='Port to listen on')
+    parser.add_argument('--age_record_dir', default='./ages_wifresh_app', help='Directory to store age records')
+    parser.add_argument('--multi_stream_poll', action='store_true', help='Grant all small streams of a source in a single POLL')
+    parser.add_argument('--poll_window', type=int, default=1, help='Max number of outstanding polls to distinct sources')
+    parser.add_argument('--burst_grants', action='store_true', help='Let sources send all remaining fragments of an update on one poll')
+    parser.add_argument('--state_backend', choices=['objects', 'numpy'], default='objects', help='Per-stream state as Python objects or as NumPy arrays with vectorized APP/MAF selection, not available with the whittle policy')
+    parser.add_argument('--max_dynamic_streams', type=int, default=0, help='Max number of streams admitted from unconfigured senders, 0 rejects them')
+    parser.add_argument('--dynamic_stream_timeout', type=float, default=10.0, help='Seconds without an update before an admitted unconfigured stream is evicted')
+    parser.add_argument('--trace_file', default=None, help='Append sampled per-update latency stamps to this file, see trace_breakdown.py')
+    parser.add_argument('--trace_sample', type=float, default=0.01, help='Fraction of the updates to trace, must match the sources')
+    parser.add_argument('--query_socket', default=None, help='Unix-domain socket path answering every connection with the live per-stream AoI as JSON, see aoi_query.py')
+    parser.add_argument('--record_file', default=None, help='Capture every inbound datagram and outbound poll to this file, see datagram_replay.py')
+    parser.add_argument('--kernel_timestamps', action='store_true', help='Account updates at their SO_TIMESTAMPNS kernel receive time and report the user-space receive delay')
+    parser.add_argument('--liveness_interval', type=float, default=1.0, help='Seconds between polls of a stream whose source advertised its next update for later')
+    args = parser.parse_args()
+    if args.state_backend == 'numpy' and args.policy not in VECTORIZED_POLICIES:
+        parser.error(f"--policy {args.policy} is not available with --state_backend numpy")
+
+    sources_addresses = []
+    if args.sources:
+        for src in args.sources:
+            ip, port, type, *stream_id = src.split(':')
+            sources_addresses.append(normalize_stream((ip, int(port), DataType[type.upper()], *map(int, stream_id))))
+    else:
+        print("No sources specified")
+        print("Usage: python destination.py --sources <ip:port:type[:stream_id]> <ip:port:type[:stream_id]> ...")
+        exit(1)
+
+    policy_kwargs = {}
+    if args.stream_weights:
+        policy_kwargs['weights'] = {}
+        for stream_weight in args.stream_weights:
+            *key, weight = stream_weight.split(':')
+            if len(key) == 1:
+                policy_kwargs['weights'][DataType[key[0].upper()]] = float(weight)
+            else:
+                ip, port, type, *stream_id = key
+                policy_kwargs['weights'][normalize_stream((ip, int(port), DataType[type.upper()], *map(int, stream_id)))] = float(weight)
+
+    destination = WiFreshDestination(
+        sources_addresses=sources_addresses,
+        listen_port=args.listen_port,
+        age_record_dir=args.age_record_dir,
+        policy=args.policy,
+        policy_kwargs=policy_kwargs,
+        multi_stream_poll=args.multi_stream_poll,
+        poll_window=args.poll_window,
+        burst_grants=args.burst_grants,
+        state_backend=args.state_backend,
+        max_dynamic_streams=args.max_dynamic_streams,
+        dynamic_stream_timeout=args.dynamic_stream_timeout,
+        trace_path=args.trace_file,
+        trace_sample=args.trace_sample,
+        query_socket_path=args.query_socket,
+        record_path=args.record_file,
+        kernel_timestamps=args.kernel_timestamps,
+        liveness_interval=args.liveness_interval
+    )
+    destination.start()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import ctypes
+import multiprocessing
+import os
+import socket
+import struct
+from typing import Dict, List, Tuple
+from sensor import DataType
+from wifresh_destination import WiFreshDestination
+from scheduling_policy import POLICIES, normalize_stream
+from source_state_table import VECTORIZED_POLICIES
+
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, 'SO_ATTACH_REUSEPORT_CBPF', 51)
+# Classic BPF opcodes used by the steering program
+BPF_LD_W_ABS = 0x20
+BPF_JMP_JEQ_K = 0x15
+BPF_RET_K = 0x06
+SKF_NET_OFF = -0x100000  # Loads relative to the IP header instead of the UDP payload
+
+def bpf_instruction(code, jt, jf, k):
+    return struct.pack('HBBI', code, jt, jf, k & 0xffffffff)
+
+def steering_program(shard_of_ip: Dict[str, int]):
+    # Return the index of the shard socket for a known source IP, anything else falls back to the reuseport hash
+    instructions = [bpf_instruction(BPF_LD_W_ABS, 0, 0, SKF_NET_OFF + 12)]  # Source address of the IPv4 header
+    for ip, shard in shard_of_ip.items():
+        instructions.append(bpf_instruction(BPF_JMP_JEQ_K, 0, 1, struct.unpack('!I', socket.inet_aton(ip))[0]))
+        instructions.append(bpf_instruction(BPF_RET_K, 0, 0, shard))
+    instructions.append(bpf_instruction(BPF_RET_K, 0, 0, 0xffffffff))
+    return instructions
+
+def attach_steering_program(sock: socket.socket, shard_of_ip: Dict[str, int]):
+    instructions = steering_program(shard_of_ip)
+    program = ctypes.create_string_buffer(b''.join(instructions))
+    sock_fprog = struct.pack('HL', len(instructions), ctypes.addressof(program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, sock_fprog)
+
+def run_shard(shard, sock, sources_addresses, report_conn, running_period, destination_kwargs):
+    # Worker process: a regular destination on its pinned sources, reporting to the supervisor instead of writing a file
+    try:
+        os.sched_setaffinity(0, {shard % os.cpu_count()})
+    except (AttributeError, OSError):
+        pass
+    # One trace file, query socket and capture file per shard, each covering the streams the shard owns
+    destination_kwargs = dict(destination_kwargs, **{
+        path_kwarg: f"{destination_kwargs[path_kwarg]}.shard{shard}"
+        for path_kwarg in ('trace_path', 'query_socket_path', 'record_path') if destination_kwargs.get(path_kwarg) is not None
+    })
+    destination = WiFreshDestination(sources_addresses=sources_addresses, sock=sock, **destination_kwargs)
+    destination.running_period = running_period
+
+    def report_ages():
+        report_conn.send({
+            'mean_ages': destination.mean_ages(),
+            'polls_sent': destination.polls_sent,
+            'poll_timeouts': destination.poll_timeouts,
+            'rejected_datagrams': destination.rejected_datagrams,
+            'evicted_streams': destination.evicted_streams,
+            'datagrams_received': destination.datagrams_received,
+            'receive_delay_total': destination.receive_delay_total,
+            'receive_delay_max': destination.receive_delay_max,
+        })
+    destination.save_ages = report_ages
+    destination.start()
+    report_conn.close()
+
+class ShardedWiFreshDestination:
+    def __init__(
+        self,
+        sources_addresses: List[Tuple[str, int, DataType]],
+        ap_of_source: Dict[str, str],
+        num_shards=2,
+        listen_port=9999,
+        age_record_dir='./ages_wifresh_app',
+        policy='app',
+        **destination_kwargs
+    ):
+        self.listen_port = listen_port
+        self.age_record_dir = age_record_dir
+        self.destination_kwargs = dict(destination_kwargs, age_record_dir=age_record_dir, policy=policy)
+        self.running_period = 600.0  # 10 minutes in seconds
+        self.num_sources = len(sources_addresses)
+        # Pin every AP, and so all of its stations, to one shard
+        aps = sorted(set(ap_of_source.get(source[0], source[0]) for source in sources_addresses))
+        num_shards = max(1, min(num_shards, len(aps)))
+        shard_of_ap = {ap: idx % num_shards for idx, ap in enumerate(aps)}
+        self.shard_of_ip = {source[0]: shard_of_ap[ap_of_source.get(source[0], source[0])] for source in sources_addresses}
+        self.shard_sources: List[List[Tuple[str, int, int, int]]] = [[] for _ in range(num_shards)]
+        for source in sources_addresses:
+            self.shard_sources[self.shard_of_ip[source[0]]].append(source)
+
+    def start(self):
+        # Bind the shard sockets in order, their position in the reuseport group is the index the steering program returns
+        socks = []
+        for _ in self.shard_sources:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('0.0.0.0', self.listen_port))
+            socks.append(sock)
+        attach_steering_program(socks[0], self.shard_of_ip)
+        context = multiprocessing.get_context('fork')  # Workers inherit the bound sockets
+        workers, report_conns = [], []
+        for shard, sources_addresses in enumerate(self.shard_sources):
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            worker = context.Process(
+                target=run_shard,
+                args=(shard, socks[shard], sources_addresses, child_conn, self.running_period, self.destination_kwargs)
+            )
+            worker.start()
+            child_conn.close()
+            workers.append(worker)
+            report_conns.append(parent_conn)
+            print(f"Shard {shard} started with {len(sources_addresses)} streams")
+        for sock in socks:
+            sock.close()
+        reports = [conn.recv() for conn in report_conns]
+        for worker in workers:
+            worker.join()
+        self.save_ages(reports)
+        print("Sharded WiFresh destination stopped")
+
+    def save_ages(self, reports):
+        record_file_path = os.path.join(self.age_record_dir, f"ages_{self.num_sources}sources.txt")
+        with open(record_file_path, 'w') as record_file:
+            mean_ages = {}
+            for report in reports:
+                mean_ages.update(report['mean_ages'])
+            for source_label, mean_age in mean_ages.items():
+                record_file.write(f"{source_label}: {mean_age}\n")
+            record_file.write(f"Mean AOI of all data sources: {sum(mean_ages.values()) / len(mean_ages)}\n")
+            for shard, report in enumerate(reports):
+                record_file.write(f"Shard {shard}: {len(report['mean_ages'])} streams, {report['polls_sent']} polls sent, {report['poll_timeouts']} polls timed out, "
+                                  f"{report['rejected_datagrams']} datagrams of unknown senders rejected, {report['evicted_streams']} unknown streams evicted\n")
+                if report['receive_delay_total']:
+                    # Only measured with kernel timestamps
+                    record_file.write(f"Shard {shard}: user-space receive delay mean {report['receive_delay_total'] / report['datagrams_received'] / 1e6:.3f} ms, "
+                                      f"max {report['receive_delay_max'] / 1e6:.3f} ms\n")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start a sharded WiFresh destination')
+    parser.add_argument('--sources', nargs='+', help='List of source addresses in the format ip:port:type[:stream_id][@ap]')
+    parser.add_argument('--shards', type=int, default=os.cpu_count(), help='Number of worker processes sharing the listen port')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='app', help='Scheduling policy of every shard')
+    parser.add_argument('--listen_port', type=int, default=9999, help='Port to listen on')
+    parser.add_argument('--age_record_dir', default='./ages_wifresh_app', help='Directory to store age records')
+    parser.add_argument('--multi_stream_poll', action='store_true', help='Grant all small streams of a source in a single POLL')
+    parser.add_argument('--poll_window', type=int, default=1, help='Max number of outstanding polls to distinct sources per shard')
+    parser.add_argument('--burst_grants', action='store_true', help='Let sources send all remaining fragments of an update on one poll')
+    parser.add_argument('--state_backend', choices=['objects', 'numpy'], default='objects', help='Per-stream state as Python objects or as NumPy arrays with vectorized APP/MAF selection, not available with the whittle policy')
+    parser.add_argument('--max_dynamic_streams', type=int, default=0, help='Max number of streams admitted from unconfigured senders per shard, 0 rejects them')
+    parser.add_argument('--dynamic_stream_timeout', type=float, default=10.0, help='Seconds without an update before an admitted unconfigured stream is evicted')
+    parser.add_argument('--trace_file', default=None, help='Append sampled per-update latency stamps to this file with a .shard<K> suffix per shard')
+    parser.add_argument('--trace_sample', type=float, default=0.01, help='Fraction of the updates to trace, must match the sources')
+    parser.add_argument('--query_socket', default=None, help='Unix-domain socket path of the live AoI query endpoint, with a .shard<K> suffix per shard')
+    parser.add_argument('--record_file', default=None, help='Capture inbound datagrams and outbound polls to this file with a .shard<K> suffix per shard')
+    parser.add_argument('--kernel_timestamps', action='store_true', help='Account updates at their SO_TIMESTAMPNS kernel receive time and report the user-space receive delay')
+    parser.add_argument('--liveness_interval', type=float, default=1.0, help='Seconds between polls of a stream whose source advertised its next update for later')
+    args = parser.parse_args()
+    if args.state_backend == 'numpy' and args.policy not in VECTORIZED_POLICIES:
+        parser.error(f"--policy {args.policy} is not available with --state_backend numpy")
+
+    sources_addresses = []
+    ap_of_source = {}
+    if args.sources:
+        for src in args.sources:
+            src, _, ap = src.partition('@')
+            ip, port, type, *stream_id = src.split(':')
+            sources_addresses.append(normalize_stream((ip, int(port), DataType[type.upper()], *map(int, stream_id))))
+            if ap:
+                ap_of_source[ip] = ap
+    else:
+        print("No sources specified")
+        print("Usage: python wifresh_sharded_destination.py --shards <K> --sources <ip:port:type[:stream_id]@ap> <ip:port:type[:stream_id]@ap> ...")
+        exit(1)
+
+    destination = ShardedWiFreshDestination(
+        sources_addresses=sources_addresses,
+        ap_of_source=ap_of_source,
+        num_shards=args.shards,
+        listen_port=args.listen_port,
+        age_record_dir=args.age_record_dir,
+        policy=args.policy,
+        multi_stream_poll=args.multi_stream_poll,
+        poll_window=args.poll_window,
+        burst_grants=args.burst_grants,
+        state_backend=args.state_backend,
+        max_dynamic_streams=args.max_dynamic_streams,
+        dynamic_stream_timeout=args.dynamic_stream_timeout,
+        trace_path=args.trace_file,
+        trace_sample=args.trace_sample,
+        query_socket_path=args.query_socket,
+        record_path=args.record_file,
+        kernel_timestamps=args.kernel_timestamps,
+        liveness_interval=args.liveness_interval
+    )
+    destination.start()
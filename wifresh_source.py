@@ -0,0 +1,441 @@
+import argparse
+import copy
+import errno
+import random
+import re
+import socket
+import time
+from typing import List
+from sensor import Sensor, SensorData, DataType, MAX_STREAM_ID, NEXT_UPDATE_FIELD, MAX_NEXT_UPDATE, IP_UDP_HEADER_SIZE
+from clock_sync import ClockSynchronizer
+from shm_sensor import SharedMemorySensor
+from update_trace import UpdateTracer, GENERATED, DEQUEUED, SENT
+from payload_codec import encode_payload, make_codec
+from delta_encoding import DeltaEncoder, NONE
+import select
+
+# Linux socket options, not exported by the socket module on every Python version
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+# Grant list of a POLL or BURST: comma separated stream ids, each with an optional 'k' keyframe request
+GRANTS = re.compile(r'[0-9]{1,5}k?(?:,[0-9]{1,5}k?)*')
+
+def parse_grants(grants):
+    # Return (granted stream ids, stream ids asking for a keyframe), None if the grant list is malformed
+    if GRANTS.fullmatch(grants) is None:
+        return None
+    stream_ids, keyframes = [], []
+    for part in grants.split(','):
+        if part.endswith('k'):
+            part = part[:-1]
+            keyframes.append(int(part))
+        stream_ids.append(int(part))
+    return stream_ids, keyframes
+
+class DestinationLink:
+    # Poll and clock state of one destination. Every destination polls the source on its own: it has its own clock
+    # offset, its own progress through the fragments of each stream and its own delta references
+    def __init__(self, address, stream_count, min_sync_interval, max_sync_interval, delta_encoders):
+        self.address = address
+        # Clock offset/skew between source and this destination, sync interval adapts between the two bounds
+        self.clock_sync = ClockSynchronizer(min_sync_interval, max_sync_interval)
+        self.clock_sync.last_sync_time = time.monotonic_ns() - random.randrange(self.clock_sync.min_sync_interval)  # Randomize initial sync time
+        self.taken = [0] * stream_count  # Update id last taken per stream id, 0 before the first one
+        self.fragment_queues: list[list[SensorData]] = [[] for _ in range(stream_count)]  # FCFS fragments still to send per stream id
+        self.delta_encoders = delta_encoders  # stream id -> DeltaEncoder against the references of this destination
+        self.trace_ip = None  # Address this destination sees the source at, only set when tracing
+
+    def stamp(self, fragment: SensorData, timestamp):
+        # Per-destination copy of a shared fragment with its timestamp in the clock of this destination, for BATCH records
+        packet = copy.copy(fragment)
+        packet.timestamp = timestamp
+        return packet
+
+class WiFreshSource:
+    policy_name = ''  # Scheduling policy of the matching destination, only used for logging
+
+    def __init__(
+        self, 
+        listen_port, 
+        destination_address,
+        sensor_list: List[Sensor],
+        min_sync_interval=1.0,
+        max_sync_interval=64.0,
+        mtu=None,
+        trace_path=None,
+        trace_sample=0.01,
+        codecs=None,
+        delta_types=(),
+        keyframe_interval=10,
+        extra_destinations=(),
+        advertise_next_update=False
+    ):
+        self.listen_port = listen_port
+        self.destination_address = destination_address  # Primary destination
+        self.mtu = mtu  # Configured link MTU, the smallest path MTU towards the destinations is used if None
+        self.destination_addresses = [destination_address, *extra_destinations]
+        self.max_packet_size = self.get_max_packet_size() - SensorData.header_size  # Max payload of one fragment
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', self.listen_port))
+        # Never let the kernel IP-fragment a datagram, every fragment is exactly one link-layer frame
+        self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        # Sensors indexed by stream id, a POLL is dispatched with one array lookup per granted stream
+        self.sensor_list = sensor_list
+        self.sensors: list[Sensor] = [None] * (max((sensor.stream_id for sensor in sensor_list), default=-1) + 1)
+        for sensor in sensor_list:
+            if not 0 <= sensor.stream_id <= MAX_STREAM_ID or self.sensors[sensor.stream_id] is not None:
+                raise ValueError(f"Invalid or duplicate stream id {sensor.stream_id} of {sensor.data_type}")
+            self.sensors[sensor.stream_id] = sensor
+        # Payload codec per DataType, applied to the whole update before fragmentation. Types without one go out as is
+        self.codecs = codecs or {}
+        # Every update is encoded and fragmented once, the destinations that take it share the fragments.
+        # Delta streams are the exception: a delta depends on the references of each destination
+        self.encoded: list[tuple] = [None] * len(self.sensors)  # (update id, fragments) of the latest encoded update per stream id
+        self.delta_streams = {sensor.stream_id for sensor in sensor_list if sensor.data_type in delta_types}
+        # Optionally every response carries the time of the next expected update of its stream, relative to its timestamp,
+        # so the destination can stop polling the stream until then
+        self.advertise_next_update = advertise_next_update
+        self.trailer_size = NEXT_UPDATE_FIELD.size if advertise_next_update else 0
+        # Empty response per stream id, pre-serialized like the fragments: a poll only rewrites the timestamp before the send
+        self.empty_responses = [
+            None if sensor is None else SensorData(is_fragmented=0, data_type=sensor.data_type, timestamp=0, data=b'', stream_id=sensor.stream_id, next_update=0 if advertise_next_update else None)
+            for sensor in self.sensors
+        ]
+        for empty_response in self.empty_responses:
+            if empty_response is not None:
+                empty_response.ready_header(0)
+        self.destinations = [
+            DestinationLink(
+                address, len(self.sensors), min_sync_interval, max_sync_interval,
+                # Delta encoding per stream of the listed DataTypes, against the last update the destination acknowledged
+                {stream_id: DeltaEncoder(keyframe_interval) for stream_id in self.delta_streams}
+            )
+            for address in self.destination_addresses
+        ]
+        self.destinations_by_address = {link.address: link for link in self.destinations}
+        # Optional sampled per-update latency stamps, keyed by the address each destination sees this source at
+        self.tracer = None
+        if trace_path is not None:
+            self.tracer = UpdateTracer(trace_path, sample_fraction=trace_sample)
+            for link in self.destinations:
+                link.trace_ip = self.local_ip(link.address)
+
+    def get_max_packet_size(self):
+        # Largest UDP payload that fits the configured MTU, or the smallest path MTU the kernel reports after connect
+        mtu = self.mtu
+        if mtu is None:
+            path_mtus = []
+            for address in self.destination_addresses:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+                sock.connect(address)
+                path_mtus.append(sock.getsockopt(socket.IPPROTO_IP, IP_MTU))
+                sock.close()
+            mtu = min(path_mtus)
+        max_packet_size = mtu - IP_UDP_HEADER_SIZE
+        print(f"MTU: {mtu}, max packet size: {max_packet_size}")
+        return max_packet_size
+
+    def local_ip(self, address):
+        # Source address of the datagrams towards a destination
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(address)
+        ip = sock.getsockname()[0]
+        sock.close()
+        return ip
+
+    def trace(self, event, record: SensorData, time_ns, link: DestinationLink):
+        if self.tracer.sampled(record.update_id):
+            self.tracer.stamp(event, link.trace_ip, self.listen_port, record.stream_id, record.update_id, time_ns)
+
+    def destination_of(self, addr):
+        link = self.destinations_by_address.get(addr)
+        if link is None and len(self.destinations) == 1:
+            link = self.destinations[0]  # A single destination may answer from another of its addresses
+        return link
+
+    def start(self):
+        print(f"WiFresh {self.policy_name} source started on port {self.listen_port}, {len(self.destinations)} destinations")
+        self.sock.setblocking(False)
+        start_transmission = False
+        while True:
+            # One clock read per pass, integer nanoseconds of the monotonic clock
+            now = time.monotonic_ns()
+            # Check if it's time to synchronize clocks
+            for link in self.destinations:
+                if link.clock_sync.due(now):
+                    self.clock_synchronization(link, now)
+
+            # Handle incoming messages
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                data, addr = self.sock.recvfrom(65535)  # Any datagram whole, a truncated grant list would grant other streams
+                data_str = data.decode(errors='replace')
+                link = self.destination_of(addr)
+                if link is None:
+                    print(f"Received message from unknown destination {addr}: {data_str}")
+                elif data_str.startswith(('POLL:', 'BURST:')):
+                    # POLL:<stream id>[,<stream id>...] grants one or several streams of this source,
+                    # BURST:<stream id> asks for every remaining fragment of its update back to back.
+                    # A 'k' suffix asks for a keyframe because the destination could not apply a delta
+                    kind, _, grants = data_str.partition(':')
+                    parsed = parse_grants(grants)
+                    if parsed is None or (kind == 'BURST' and len(parsed[0]) != 1):
+                        print(f"Received malformed {kind} from {addr}: {data_str}")
+                    else:
+                        stream_ids, keyframes = parsed
+                        if not start_transmission:
+                            start_transmission = True
+                        if keyframes:
+                            self.request_keyframes(keyframes, link)
+                        if kind == 'BURST':
+                            self.process_burst(stream_ids[0], link, now)
+                        elif len(stream_ids) == 1:
+                            self.process_poll(stream_ids[0], link, now)
+                        else:
+                            self.process_multi_poll(stream_ids, link, now)
+                elif data_str.startswith('TIME_RESPONSE'):
+                    # Handle time synchronization response
+                    parts = data_str.split(':')
+                    if len(parts) == 3:
+                        dest_time = int(parts[1])
+                        t1 = int(parts[2])
+                        # Keep the lowest-RTT samples and refit offset and skew
+                        link.clock_sync.add_sample(t1, dest_time, now)
+                        # print(f"Updated clock offset: {link.clock_sync.offset(now)} ns")
+                else:
+                    print(f"Received unknown message from {addr}: {data_str}")
+            if start_transmission:
+                for sensor in self.sensor_list:
+                    sensor.generate_data(now)
+                    self.prepare_response(sensor)
+
+    def sensor_of(self, stream_id):
+        sensor = self.sensors[stream_id] if 0 <= stream_id < len(self.sensors) else None
+        if sensor is None:
+            print(f"Unknown stream id: {stream_id}")
+        return sensor
+
+    def request_keyframes(self, stream_ids, link: DestinationLink):
+        for stream_id in stream_ids:
+            encoder = link.delta_encoders.get(stream_id)
+            if encoder is not None:
+                encoder.request_keyframe()
+
+    def process_poll(self, stream_id, link: DestinationLink, now):
+        sensor = self.sensor_of(stream_id)
+        if sensor is None:
+            return
+        packet, timestamp = self.next_response(sensor, link, now)
+        self.send_packet(packet, timestamp, link)
+
+    def process_burst(self, stream_id, link: DestinationLink, now):
+        sensor = self.sensor_of(stream_id)
+        if sensor is None:
+            return
+        packet, timestamp = self.next_response(sensor, link, now)
+        self.send_packet(packet, timestamp, link)
+        while packet.backlog > 0:
+            packet, timestamp = self.next_response(sensor, link, now)
+            self.send_packet(packet, timestamp, link)
+
+    def process_multi_poll(self, stream_ids, link: DestinationLink, now):
+        # Pack the freshest update of every granted stream into one datagram, in grant order
+        records = []
+        budget = self.max_packet_size
+        for idx, stream_id in enumerate(stream_ids):
+            sensor = self.sensor_of(stream_id)
+            if sensor is None:
+                continue
+            record_size = SensorData.batch_record_size(self.pending_data_size(sensor, link) + self.trailer_size)
+            if record_size <= budget:
+                records.append(self.next_response(sensor, link, now))
+                budget -= record_size
+            elif idx == 0:
+                # The primary stream needs fragmentation, answer it alone as a single-stream poll
+                self.process_poll(stream_id, link, now)
+                return
+        if len(records) == 1:
+            self.send_packet(*records[0], link)
+        elif records:
+            batch_time = now + link.clock_sync.offset(now)
+            self.send_packet(SensorData.pack_batch([link.stamp(*record) for record in records], batch_time), batch_time, link)
+            if self.tracer is not None:
+                sent_time = time.monotonic_ns() + link.clock_sync.offset(now)
+                for record, _ in records:
+                    self.trace(SENT, record, sent_time, link)
+
+    def pending_data_size(self, sensor: Sensor, link: DestinationLink):
+        # Payload size of the packet next_response would return for this sensor, an upper bound if a codec shrinks it
+        fragment_queue = link.fragment_queues[sensor.stream_id]
+        if fragment_queue:
+            return len(fragment_queue[0].data)
+        elif sensor.complete_data_queue and sensor.complete_data_queue[-1].update_id != link.taken[sensor.stream_id]:
+            return len(sensor.complete_data_queue[-1].data)
+        return 0
+
+    def prepare_response(self, sensor: Sensor):
+        # Encode, fragment and serialize the newest update as soon as it is generated, off the poll-to-send path.
+        # Delta streams are encoded when polled, a delta depends on what the polling destination acknowledged
+        if not sensor.complete_data_queue or sensor.stream_id in self.delta_streams:
+            return
+        info_update = sensor.complete_data_queue[-1]
+        encoded = self.encoded[sensor.stream_id]
+        if encoded is None or encoded[0] != info_update.update_id:
+            del sensor.complete_data_queue[:-1]  # Older updates are never sent
+            self.encode_update(info_update, None)
+
+    def next_response(self, sensor: Sensor, link: DestinationLink, now):
+        # Return (shared pre-serialized packet, its timestamp in the clock of the destination)
+        fragment_queue = link.fragment_queues[sensor.stream_id]
+        if fragment_queue:
+            fragment = fragment_queue.pop(0)  # Get next fragment from FCFS queue
+            return fragment, fragment.timestamp + link.clock_sync.offset(now)
+        elif sensor.complete_data_queue and sensor.complete_data_queue[-1].update_id != link.taken[sensor.stream_id]:
+            info_update = sensor.complete_data_queue[-1]  # Get update from LCFS queue
+            del sensor.complete_data_queue[:-1]  # Older updates are never sent, the latest stays for the other destinations
+            link.taken[sensor.stream_id] = info_update.update_id
+            fragments = self.encode_update(info_update, link)
+            if self.tracer is not None:
+                offset = link.clock_sync.offset(now)
+                self.trace(GENERATED, info_update, info_update.timestamp + offset, link)
+                self.trace(DEQUEUED, info_update, now + offset, link)
+            fragment_queue.extend(fragments[1:])  # Add to FCFS queue
+            return fragments[0], info_update.timestamp + link.clock_sync.offset(now)  # Send first fragment
+        else:
+            # Send empty packet with adjusted timestamp
+            empty_response = self.empty_responses[sensor.stream_id]
+            if self.advertise_next_update:
+                next_update = (sensor.last_generation_time + sensor.generation_interval - now) // 1000
+                empty_response.next_update = min(max(next_update, 0), MAX_NEXT_UPDATE)
+            return empty_response, now + link.clock_sync.offset(now)
+
+    def encode_update(self, info_update: SensorData, link: DestinationLink = None):
+        # Fragments of the update in the source clock with their headers serialized, shared by the destinations.
+        # Cached per stream, link is only needed for the delta encoder of the destination that polls a delta stream
+        encoder = None if link is None else link.delta_encoders.get(info_update.stream_id)
+        if encoder is None:
+            encoded = self.encoded[info_update.stream_id]
+            if encoded is not None and encoded[0] == info_update.update_id:
+                return encoded[1]
+        delta, data = NONE, info_update.data
+        if encoder is not None:
+            delta, data = encoder.encode(info_update.update_id, data)
+        codec_id = 0
+        codec = self.codecs.get(info_update.data_type)
+        if codec is not None:
+            codec_id, data = encode_payload(codec, data)
+        chunk_size = self.max_packet_size - self.trailer_size
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] or [data]
+        next_update = min(self.sensors[info_update.stream_id].generation_interval // 1000, MAX_NEXT_UPDATE) if self.advertise_next_update else None
+        fragments = [
+            SensorData(
+                is_fragmented=(idx + 1) != len(chunks),
+                data_type=info_update.data_type,
+                timestamp=info_update.timestamp,
+                data=chunk,
+                update_id=info_update.update_id,
+                frag_index=idx,
+                frag_count=len(chunks),  # The remaining fragment backlog follows from index and count
+                stream_id=info_update.stream_id,
+                codec=codec_id,
+                delta=delta,
+                next_update=next_update
+            )
+            for idx, chunk in enumerate(chunks)
+        ]
+        for fragment in fragments:
+            fragment.ready_header(fragment.timestamp)
+        if encoder is None:
+            self.encoded[info_update.stream_id] = (info_update.update_id, fragments)
+        return fragments
+
+    def send_packet(self, packet: SensorData, timestamp, link: DestinationLink):
+        # Header and payload go out as separate buffers, so payloads backed by a shared-memory ring are not copied.
+        # The header is serialized once per packet, only the timestamp is rewritten in place for this send
+        try:
+            bytes_sent = self.sock.sendmsg([packet.ready_header(timestamp), packet.data, packet.trailer_bytes()], [], 0, link.address)
+            # print(f"Sent {bytes_sent} bytes to {link.address}")
+            if self.tracer is not None and packet.data_type != DataType.BATCH and packet.frag_index == packet.frag_count - 1:
+                sent_time = time.monotonic_ns()
+                self.trace(SENT, packet, sent_time + link.clock_sync.offset(sent_time), link)
+        except BlockingIOError:
+            # Full socket buffer, e.g. back-to-back fragments of a burst grant: the datagram is dropped like a lost one
+            print(f"source send_packet to {link.address} BlockingIOError")
+        except OSError as e:
+            if e.errno == errno.EMSGSIZE:
+                self.update_path_mtu()
+            elif e.errno == errno.ENOBUFS:
+                print(f"source send_packet to {link.address} ENOBUFS")
+            else:
+                raise
+
+    def update_path_mtu(self):
+        # The path MTU shrank: re-read it and drop queued fragments that no longer fit, the next poll takes a fresh update
+        self.mtu = None
+        self.max_packet_size = self.get_max_packet_size() - SensorData.header_size
+        self.encoded = [None] * len(self.sensors)
+        for link in self.destinations:
+            for fragment_queue in link.fragment_queues:
+                if any(len(fragment.data) > self.max_packet_size - self.trailer_size for fragment in fragment_queue):
+                    fragment_queue.clear()
+
+    def clock_synchronization(self, link: DestinationLink, current_time):
+        # Send a single TIME_REQUEST to the destination, the filter only needs one sample per interval
+        request = SensorData(is_fragmented=0, data_type=DataType.TIME_REQUEST, timestamp=current_time, data=b'')
+        try:
+            self.sock.sendto(request.to_bytes(), link.address)
+        except BlockingIOError:
+            print("source clock_synchronization sendto BlockingIOError")
+        link.clock_sync.request_sent(current_time)
+
+def main(source_class):
+    parser = argparse.ArgumentParser(description=f'Start WiFresh {source_class.policy_name} source')
+    parser.add_argument('--listen_port', type=int, required=True, help='Port to listen on')
+    parser.add_argument('--destination', nargs='+', required=True, help='Destination addresses in the format ip:port, the first is the primary, every destination polls independently')
+    parser.add_argument('--sensors', nargs='+', required=True, help='Sensor configurations in the format type:size:frequency[:stream_id], the stream id defaults to the type value')
+    parser.add_argument('--sensor_backend', choices=['inline', 'shm'], default='inline', help='Generate data in the source loop or in producer processes writing to a shared-memory ring')
+    parser.add_argument('--ring_slots', type=int, default=8, help='Number of slots of each shared-memory sensor ring')
+    parser.add_argument('--mtu', type=int, default=None, help='Link MTU used to size fragments, defaults to the path MTU towards the destination')
+    parser.add_argument('--trace_file', default=None, help='Append sampled per-update latency stamps to this file, see trace_breakdown.py')
+    parser.add_argument('--trace_sample', type=float, default=0.01, help='Fraction of the updates to trace, must match the destination')
+    parser.add_argument('--codecs', nargs='+', default=[], help='Payload codecs in the format type:codec[:level], codec none, zlib or lzma, see codec_benchmark.py')
+    parser.add_argument('--delta_types', nargs='+', default=[], help='Data types sent as deltas against the last update the destination acknowledged')
+    parser.add_argument('--keyframe_interval', type=int, default=10, help='A delta stream sends a full keyframe at least every this many updates')
+    parser.add_argument('--advertise_next_update', action='store_true', help='Carry the time of the next expected update in every response, so the destination stops polling until then')
+    args = parser.parse_args()
+
+    destination_addresses = []
+    for destination_arg in args.destination:
+        dest_ip, dest_port = destination_arg.split(':')
+        destination_addresses.append((dest_ip, int(dest_port)))
+
+    # Parse sensor configurations
+    sensor_list = []
+    for sensor_arg in args.sensors:
+        sensor_type_str, size_str, frequency_str, *stream_id_str = sensor_arg.split(':')
+        sensor_type = DataType[sensor_type_str.upper()]
+        size = int(size_str)
+        frequency = float(frequency_str)
+        stream_id = int(stream_id_str[0]) if stream_id_str else None
+        if args.sensor_backend == 'shm':
+            sensor_list.append(SharedMemorySensor(sensor_type, size, frequency, ring_slots=args.ring_slots, stream_id=stream_id))
+        else:
+            sensor_list.append(Sensor(sensor_type, size, frequency, stream_id))
+        print(f"Added sensor: {sensor_type} - stream id: {sensor_list[-1].stream_id} - packet size: {size} - frequency: {frequency}")
+
+    source = source_class(
+        listen_port=args.listen_port,
+        destination_address=destination_addresses[0],
+        sensor_list=sensor_list,
+        mtu=args.mtu,
+        trace_path=args.trace_file,
+        trace_sample=args.trace_sample,
+        codecs={DataType[codec_arg.split(':')[0].upper()]: make_codec(codec_arg.partition(':')[2]) for codec_arg in args.codecs},
+        delta_types={DataType[type_str.upper()] for type_str in args.delta_types},
+        keyframe_interval=args.keyframe_interval,
+        extra_destinations=destination_addresses[1:],
+        advertise_next_update=args.advertise_next_update
+    )
+    source.start()